@@ -0,0 +1,110 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from neuralnetwork import GenomeLayout, NeuralNetwork
+
+# Archive file: header (magic, format version, genes per record, layout length), JSON layout, then fixed size records.
+# A sidecar index file holds one (generation, first record, record count) row per recorded generation.
+ARCHIVE_MAGIC = b'SNAKEHOF'
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = struct.Struct('<8sIII')
+ARCHIVE_ALIGNMENT = 64
+
+
+def record_type(genes: int):
+    return np.dtype([('generation', '<i8'), ('rank', '<i8'), ('fitness', '<f8'), ('length', '<i8'), ('age', '<i8'),
+                     ('genome', '<f8', (genes,))])
+
+
+# Append-only, memory-mapped archive of the top genomes of every generation
+class HallOfFame(object):
+    def __init__(self, path: str, layout: GenomeLayout = None, top: int = 10):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.top = top
+
+        if os.path.exists(path):
+            with open(path, 'rb') as handle:
+                magic, version, genes, length = ARCHIVE_HEADER.unpack(handle.read(ARCHIVE_HEADER.size))
+                if magic != ARCHIVE_MAGIC:
+                    raise ValueError(path + ' is not a hall of fame archive')
+                if version > ARCHIVE_VERSION:
+                    raise ValueError(path + ' is archive version ' + str(version) + ', newer than this code')
+                description = json.loads(handle.read(length).decode('utf-8'))
+            if layout is not None and description != layout.describe():
+                raise ValueError(path + ' archives networks ' + str(description) + ', not ' + str(layout.describe()))
+            self.layout = GenomeLayout.from_description(description)
+        else:
+            self.layout = layout
+            encoded = json.dumps(layout.describe()).encode('utf-8')
+            length = len(encoded)
+            with open(path, 'wb') as handle:
+                handle.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, layout.size, length))
+                handle.write(encoded)
+                handle.write(b'\0' * (self.records_offset(length) - ARCHIVE_HEADER.size - length))
+            open(self.index_path, 'wb').close()
+
+        self.offset = self.records_offset(length)
+        self.type = record_type(self.layout.size)
+        # Records written without an index row (say, a crash between the two writes) are kept but never listed
+        self.count = (os.path.getsize(path) - self.offset) // self.type.itemsize
+        self.index = {}
+        index = np.fromfile(self.index_path, dtype='<i8').reshape(-1, 3)
+        for generation, first, count in index.tolist():
+            self.index[generation] = (first, count)
+        self.records = None
+
+    @staticmethod
+    def records_offset(layout_length: int):
+        end = ARCHIVE_HEADER.size + layout_length
+        return -(-end // ARCHIVE_ALIGNMENT) * ARCHIVE_ALIGNMENT
+
+    def __len__(self):
+        return self.count
+
+    def record(self, generation: int, snakes: list):
+        # snakes: a generation's snakes, best first. A generation that's already archived (played again after
+        # resuming from an older checkpoint, say) keeps the records it has.
+        if generation in self.index:
+            return
+        best = snakes[0:self.top]
+        records = np.zeros(len(best), dtype=self.type)
+        for rank, snake in enumerate(best):
+            records[rank] = (generation, rank, float(snake.fitness), snake.length, snake.age, snake.brain.genome)
+
+        with open(self.path, 'ab') as handle:
+            records.tofile(handle)
+        with open(self.index_path, 'ab') as handle:
+            np.array([generation, self.count, len(records)], dtype='<i8').tofile(handle)
+
+        self.index[generation] = (self.count, len(records))
+        self.count += len(records)
+        self.records = None
+
+    def all(self):
+        # Every record, memory-mapped; remapped after new generations are appended
+        if self.records is None or len(self.records) != self.count:
+            if self.count == 0:
+                return np.zeros(0, dtype=self.type)
+            self.records = np.memmap(self.path, dtype=self.type, mode='r', offset=self.offset, shape=(self.count,))
+        return self.records
+
+    def generations(self):
+        return sorted(self.index)
+
+    def generation(self, generation: int):
+        first, count = self.index[generation]
+        return self.all()[first:first + count]
+
+    def entry(self, generation: int, rank: int = 0):
+        return self.generation(generation)[rank]
+
+    def best(self, count: int = 1):
+        records = self.all()
+        return records[np.argsort(-records['fitness'], kind='stable')[0:count]]
+
+    def brain(self, record):
+        return NeuralNetwork.from_genome(self.layout, np.array(record['genome']))
@@ -0,0 +1,182 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from genetic.activation import ReLU
+from neuralnetwork import NeuralNetwork, BatchedNetwork
+from population import Population
+from sensing import SENSES
+from vector import Vector
+
+SEED = 1234
+# Ticks timed per population in bench_move. Every configuration's first generation lasts longer than this, so the
+# workload never runs into breeding.
+MOVE_TICKS = 30
+
+
+def timed(function, repeats: int, rounds: int = 3):
+    # Seconds for repeats calls, from the fastest of a few rounds so a busy moment on the machine doesn't count
+    fastest = None
+    for attempt in range(0, rounds):
+        start = time.perf_counter()
+        for i in range(0, repeats):
+            function()
+        seconds = time.perf_counter() - start
+        fastest = seconds if fastest is None else min(fastest, seconds)
+    return fastest
+
+
+def bench_senses(results: dict, scale: float):
+    # Snakes a few moves into their games, so there's some body to see
+    population = Population(200, Vector(20, 20), 10, seed=SEED)
+    for tick in range(0, 5):
+        population.move()
+    snakes = [snake for snake in population.snakes if snake.alive]
+    repeats = max(1, int(100 * scale))
+
+    def sense_all():
+        for snake in snakes:
+            snake.senses()
+
+    seconds = timed(sense_all, repeats)
+    results['senses_per_second'] = (len(snakes) * repeats / seconds, True)
+
+
+def bench_forward(results: dict, scale: float):
+    rng = np.random.RandomState(SEED)
+    networks = [NeuralNetwork.create(SENSES, [20, 20], 4, ReLU(), rng) for i in range(0, 1100)]
+    inputs = rng.random_sample((len(networks), SENSES))
+
+    repeats = max(1, int(20000 * scale))
+    network = networks[0]
+    seconds = timed(lambda: network.forward(inputs[0]), repeats)
+    results['forward_per_second'] = (repeats / seconds, True)
+
+    batch = BatchedNetwork(networks)
+    repeats = max(1, int(200 * scale))
+    seconds = timed(lambda: batch.forward(inputs), repeats)
+    results['batched_forward_rows_per_second'] = (len(networks) * repeats / seconds, True)
+
+    batch = BatchedNetwork([network.astype(np.float32) for network in networks])
+    seconds = timed(lambda: batch.forward(inputs), repeats)
+    results['batched_forward_float32_rows_per_second'] = (len(networks) * repeats / seconds, True)
+
+
+def bench_move(results: dict, scale: float):
+    # The same workload whatever the scale: each repeat times the first MOVE_TICKS ticks of a fresh population with
+    # the same seed, and the fastest repeat counts. scale only changes how many repeats there are.
+    repeats = max(3, int(10 * scale))
+    for vectorized in (False, True):
+        for snakes, size in ((100, 20), (1100, 20), (1100, 40), (1100, 100)):
+            fastest = None
+            for repeat in range(0, repeats):
+                population = Population(snakes, Vector(size, size), 10, vectorized, seed=SEED)
+                # Bigger boards keep more snakes alive per tick, so moves per second is the fairer comparison.
+                # Every repeat plays the same games, so makes the same moves.
+                moves = 0
+                start = time.perf_counter()
+                for tick in range(0, MOVE_TICKS):
+                    moves += population.live_snakes()
+                    population.move()
+                seconds = time.perf_counter() - start
+                fastest = seconds if fastest is None else min(fastest, seconds)
+                if population.generations != 1:
+                    raise RuntimeError('A generation ended within ' + str(MOVE_TICKS) + ' ticks of ' + str(snakes) +
+                                       ' snakes on a ' + str(size) + ' grid; lower MOVE_TICKS')
+            name = 'move_' + ('vectorized_' if vectorized else '') + str(snakes) + '_snakes_' + str(size) + '_grid'
+            results[name + '_ticks_per_second'] = (MOVE_TICKS / fastest, True)
+            results[name + '_snake_moves_per_second'] = (moves / fastest, True)
+
+
+def bench_next_generation(results: dict, scale: float):
+    population = Population(1100, Vector(20, 20), 10, True, seed=SEED)
+    repeats = max(1, int(10 * scale))
+
+    def breed():
+        for snake in population.snakes:
+            snake.fitness = population.random.randint(1, 100000)
+            snake.alive = False
+        population.next_generation()
+
+    seconds = timed(breed, repeats)
+    results['next_generation_milliseconds'] = (seconds / repeats * 1000, False)
+
+
+def run(scale: float):
+    results = {}
+    bench_senses(results, scale)
+    bench_forward(results, scale)
+    bench_move(results, scale)
+    bench_next_generation(results, scale)
+    return {name: {"value": value, "higher_is_better": higher} for name, (value, higher) in results.items()}
+
+
+def regressions(results: dict, baseline: dict, tolerance: float):
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]["value"]
+        if result["higher_is_better"]:
+            worse = result["value"] < expected * (1 - tolerance)
+        else:
+            worse = result["value"] > expected * (1 + tolerance)
+        if worse:
+            found.append(name)
+    return found
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Measure simulation, inference and breeding throughput')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every repeat count by this')
+    parser.add_argument('--output', default=None, help='write results as JSON here')
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    parser.add_argument('--runs', type=int, default=1,
+                        help='run everything this many times and take the median of each result, as for a baseline')
+    options = parser.parse_args(args)
+
+    # Results only compare with a baseline measured at the same scale, so that's checked before anything is run
+    baseline = None
+    if not options.save_baseline:
+        try:
+            with open(options.baseline) as handle:
+                baseline = json.load(handle)
+        except FileNotFoundError:
+            print("No baseline at " + options.baseline + ", nothing to compare against")
+        if baseline is not None and baseline.get("scale") != options.scale:
+            print("Baseline " + options.baseline + " was measured at scale " + str(baseline.get("scale")) +
+                  ", not " + str(options.scale) + "; run at that scale or save a new baseline", file=sys.stderr)
+            return 1
+
+    runs = [run(options.scale) for i in range(0, max(1, options.runs))]
+    results = {name: dict(result, value=float(np.median([results[name]["value"] for results in runs])))
+               for name, result in runs[0].items()}
+    for name, result in results.items():
+        print(name + ": " + str(round(result["value"], 2)), flush=True)
+
+    report = {"scale": options.scale, "results": results}
+    if options.output:
+        with open(options.output, 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+
+    if options.save_baseline:
+        with open(options.baseline, 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+        return 0
+
+    if baseline is None:
+        return 0
+    baseline = baseline["results"]
+    slower = regressions(results, baseline, options.tolerance)
+    for name in slower:
+        print("REGRESSION " + name + ": " + str(round(results[name]["value"], 2)) + " against baseline " +
+              str(round(baseline[name]["value"], 2)), file=sys.stderr)
+    return 1 if slower else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
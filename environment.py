@@ -0,0 +1,298 @@
+import numpy as np
+
+import sensing
+from neuralnetwork import BatchedNetwork
+from profiler import Profiler
+from snake import Grid, calculate_fitness
+
+# Ray directions, in the same order Snake.senses scans them
+DIRECTIONS = np.array(sensing.DIRECTIONS)
+# Ray index for a (sign y, sign x) pair, offset by one
+DIRECTION_INDEX = np.full((3, 3), -1)
+for index, (direction_x, direction_y) in enumerate(DIRECTIONS):
+    DIRECTION_INDEX[direction_y + 1, direction_x + 1] = index
+
+# Velocities for up, down, left and right, matching Snake.steer
+MOVES = np.array([[0, -1], [0, 1], [-1, 0], [1, 0]])
+
+GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+# Occupancy flags per cell: part of the body right now, and moved into at some point of the game
+BODY = np.uint8(1)
+VISITED = np.uint8(2)
+
+
+def splitmix(values: np.ndarray):
+    # uint64 hash of each value, spread evenly over the whole range
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def aggregate(values, episodes: int, method='mean'):
+    # One result per brain from its episodes, which sit next to each other in values. method is 'mean', 'min' or a
+    # quantile between 0 and 1.
+    values = np.asarray(values)
+    if episodes == 1:
+        return values
+    values = values.reshape(-1, episodes)
+    if method == 'mean':
+        return values.mean(axis=1)
+    if method == 'min':
+        return values.min(axis=1)
+    return np.quantile(values, float(method), axis=1)
+
+
+def aggregate_results(fitness, length, age, episodes: int, method='mean'):
+    # Fitness, length and age per brain as lists, with lengths and ages kept whole
+    return (aggregate(fitness, episodes, method).tolist(),
+            np.rint(aggregate(length, episodes, method)).astype(int).tolist(),
+            np.rint(aggregate(age, episodes, method)).astype(int).tolist())
+
+
+# Every game of a population held in flat arrays and stepped together. Each brain plays `episodes` games at once,
+# as games brain * episodes to brain * episodes + episodes - 1.
+# Given seeds (one per game), each game draws its random numbers from its own seed alone, so it plays out the same
+# whatever else is in the batch. Otherwise every game draws from the one seed.
+class SnakeEnvironment(object):
+    def __init__(self, grid: Grid, brains, seed=None, profiler: Profiler = None, episodes=1, seeds=None):
+        self.grid = grid
+        self.episodes = episodes
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.random = np.random.RandomState(seed)
+        self.width = grid.dimensions.x
+        self.height = grid.dimensions.y
+        self.cells = self.width * self.height
+        self.count = len(brains) * episodes
+        count = self.count
+        self.seeds = None if seeds is None else np.asarray(seeds, dtype=np.uint64).ravel()
+        self.draws = np.zeros(count, dtype=np.uint64)
+
+        games = np.arange(count)
+        self.x = 1 + self.draw(games, self.width - 1)
+        self.y = 1 + self.draw(games, self.height - 1)
+        self.velocity_x = np.zeros(count, dtype=int)
+        self.velocity_y = np.ones(count, dtype=int)
+        self.food_x = self.draw(games, self.width)
+        self.food_y = self.draw(games, self.height)
+        self.hunger = np.full(count, 5 * (self.width + self.height))
+        self.age = np.zeros(count, dtype=int)
+        self.length = np.ones(count, dtype=int)
+        self.explored = np.zeros(count, dtype=int)
+        self.alive = np.ones(count, dtype=bool)
+        self.fitness = [0] * count
+
+        # BODY and VISITED flags of every cell per game, plus a ring buffer of y * width + x body cells (oldest
+        # first). The ring buffer starts small and doubles whenever a snake outgrows it. explored counts VISITED
+        # cells once each, as Snake.visited does; keeping them in the same array means a move reads one cell.
+        self.occupancy = np.zeros((count, self.height, self.width), dtype=np.uint8)
+        self.tail = np.zeros((count, min(self.cells, 16)), dtype=np.int32)
+        self.tail_start = np.zeros(count, dtype=int)
+        self.tail_count = np.zeros(count, dtype=int)
+
+        self.brains = brains if isinstance(brains, BatchedNetwork) else BatchedNetwork(brains)
+        if episodes > 1:
+            self.brains = self.brains.repeat(episodes)
+        self.brain_games = np.arange(count)
+        self.brain_rows = np.arange(count)
+
+    def step(self):
+        games = np.flatnonzero(self.alive)
+        if len(games) == 0:
+            return
+        profiler = self.profiler
+        started = profiler.now()
+        self.age[games] += 1
+        self.hunger[games] -= 1
+
+        won = games[self.length[games] == self.cells]
+        if len(won):
+            # Win!
+            self.die(won)
+            games = games[self.alive[games]]
+
+        eating = games[(self.x[games] == self.food_x[games]) & (self.y[games] == self.food_y[games])]
+        if len(eating):
+            # Nom.
+            self.eat(eating)
+
+        profiler.add('movement', started, 0)
+        directions = self.think(games)
+        started = profiler.now()
+        self.steer(games, directions)
+
+        new_x = self.x[games] + self.velocity_x[games]
+        new_y = self.y[games] + self.velocity_y[games]
+
+        # Collision
+        inside = (new_x >= 0) & (new_y >= 0) & (new_x < self.width) & (new_y < self.height)
+        flags = np.zeros(len(games), dtype=np.uint8)
+        flags[inside] = self.occupancy[games[inside], new_y[inside], new_x[inside]]
+        dying = ~inside | (flags & BODY).astype(bool)
+        # Died of hunger...
+        dying |= self.hunger[games] < 0
+        self.die(games[dying])
+
+        moving = ~dying
+        games = games[moving]
+        new_x = new_x[moving]
+        new_y = new_y[moving]
+        self.explored[games] += (flags[moving] & VISITED) == 0
+
+        full = games[self.tail_count[games] >= self.length[games]]
+        oldest = self.tail[full, self.tail_start[full]]
+        self.occupancy[full, oldest // self.width, oldest % self.width] = VISITED
+        self.tail_start[full] = (self.tail_start[full] + 1) % self.tail.shape[1]
+        self.tail_count[full] -= 1
+
+        if len(games) and self.tail_count[games].max() >= self.tail.shape[1]:
+            self.grow_tail()
+        end = (self.tail_start[games] + self.tail_count[games]) % self.tail.shape[1]
+        self.tail[games, end] = new_y * self.width + new_x
+        self.tail_count[games] += 1
+        self.occupancy[games, new_y, new_x] = BODY | VISITED
+
+        self.x[games] = new_x
+        self.y[games] = new_y
+        profiler.add('movement', started, len(games))
+
+    def grow_tail(self):
+        # Twice the room, with every ring buffer unrolled to start at 0
+        capacity = self.tail.shape[1]
+        order = (self.tail_start[:, None] + np.arange(capacity)) % capacity
+        tail = np.zeros((self.count, min(self.cells, capacity * 2)), dtype=np.int32)
+        tail[:, 0:capacity] = np.take_along_axis(self.tail, order, axis=1)
+        self.tail = tail
+        self.tail_start[:] = 0
+
+    def think(self, games):
+        # Drop dead games from the batch once they make up most of it
+        if len(games) * 2 < len(self.brain_games):
+            keep = np.flatnonzero(self.alive[self.brain_games])
+            self.brains = self.brains.select(keep)
+            self.brain_games = self.brain_games[keep]
+            self.brain_rows[self.brain_games] = np.arange(len(self.brain_games))
+
+        rows = self.brain_rows[games]
+        started = self.profiler.now()
+        senses = np.zeros((len(self.brain_games), sensing.SENSES))
+        senses[rows] = self.senses(games)
+        started = self.profiler.add('sensing', started, len(games))
+        directions = self.brains.think(senses)[rows]
+        self.profiler.add('forward', started)
+        return directions
+
+    def steer(self, games, directions):
+        move_x = MOVES[directions, 0]
+        move_y = MOVES[directions, 1]
+        # Snakes can't turn back on themselves
+        turning = (move_x != -self.velocity_x[games]) | (move_y != -self.velocity_y[games])
+        self.velocity_x[games[turning]] = move_x[turning]
+        self.velocity_y[games[turning]] = move_y[turning]
+
+    def eat(self, games):
+        self.length[games] += 1
+        self.hunger[games] = self.cells
+        self.place_food(games)
+
+    def place_food(self, games):
+        pending = games
+        for attempt in range(0, 100):
+            x = self.draw(pending, self.width)
+            y = self.draw(pending, self.height)
+            self.food_x[pending] = x
+            self.food_y[pending] = y
+            pending = pending[(self.occupancy[pending, y, x] & BODY).astype(bool)]
+            if len(pending) == 0:
+                return
+
+    def draw(self, games, high: int):
+        # A random number in [0, high) for each of the games
+        if self.seeds is None:
+            return self.random.randint(0, high, len(games))
+        self.draws[games] += np.uint64(1)
+        values = splitmix(self.seeds[games] + self.draws[games] * GOLDEN)
+        return (values % np.uint64(high)).astype(int)
+
+    def die(self, games):
+        self.alive[games] = False
+        for game in games.tolist():
+            self.fitness[game] = calculate_fitness(int(self.length[game]), int(self.age[game]),
+                                                   int(self.explored[game]), self.cells)
+
+    def senses(self, games):
+        x = self.x[games]
+        y = self.y[games]
+        food_x = self.food_x[games]
+        food_y = self.food_y[games]
+        senses = np.zeros((len(games), sensing.SENSES))
+
+        # Food is only visible along one of the rays, unless the body is in the way. No body cell is further from
+        # the head than the snake is long, so rays are only walked that far.
+        senses[:, 0:8] = 1
+        dx = food_x - x
+        dy = food_y - y
+        distance = np.maximum(np.abs(dx), np.abs(dy))
+        visible = (distance > 0) & ((dx == 0) | (dy == 0) | (np.abs(dx) == np.abs(dy)))
+        step_x = np.sign(dx)
+        step_y = np.sign(dy)
+        reach = np.minimum(distance, self.length[games])
+        for step in range(1, int(reach[visible].max(initial=0))):
+            ray = np.flatnonzero(visible & (reach > step))
+            visible[ray] = (self.occupancy[games[ray], y[ray] + step * step_y[ray], x[ray] + step * step_x[ray]] &
+                            BODY) == 0
+        visible = np.flatnonzero(visible)
+        senses[visible, DIRECTION_INDEX[step_y[visible] + 1, step_x[visible] + 1]] = 1 / distance[visible]
+
+        # Walls and body only matter right next to the head. All 8 neighbours are looked at in one go, with the ones
+        # off the board clamped onto it and masked out again.
+        ray_x = x[:, np.newaxis] + DIRECTIONS[:, 0]
+        ray_y = y[:, np.newaxis] + DIRECTIONS[:, 1]
+        inside = (ray_x >= 0) & (ray_y >= 0) & (ray_x < self.width) & (ray_y < self.height)
+        senses[:, 8:16] = ~inside
+        body = self.occupancy[games[:, np.newaxis], ray_y.clip(0, self.height - 1), ray_x.clip(0, self.width - 1)]
+        food = (ray_x == food_x[:, np.newaxis]) & (ray_y == food_y[:, np.newaxis])
+        senses[:, 16:24] = (body & BODY).astype(bool) & inside & ~food
+
+        velocity_x = self.velocity_x[games]
+        velocity_y = self.velocity_y[games]
+        senses[:, 24] = velocity_y < 0
+        senses[:, 25] = velocity_y > 0
+        senses[:, 26] = velocity_x < 0
+        senses[:, 27] = velocity_x > 0
+        return senses
+
+    def run(self):
+        while not self.done():
+            self.step()
+
+    def done(self):
+        return not self.alive.any()
+
+    def live(self):
+        return int(np.count_nonzero(self.alive))
+
+    def leader(self):
+        # Longest live game
+        return int(np.argmax(np.where(self.alive, self.length, 0)))
+
+    def segments(self, game: int):
+        cells = (self.tail_start[game] + np.arange(self.tail_count[game])) % self.tail.shape[1]
+        cells = self.tail[game, cells]
+        return zip((cells % self.width).tolist(), (cells // self.width).tolist())
+
+    def results(self, method='mean'):
+        # Fitness, length and age per brain, each aggregated over its episodes
+        return aggregate_results(self.fitness, self.length, self.age, self.episodes, method)
+
+    def sync(self, snakes: list, method='mean'):
+        # Hand the results back to the snakes, so breeding works as usual
+        fitness, length, age = self.results(method)
+        alive = self.alive.reshape(-1, self.episodes).any(axis=1).tolist()
+        for brain, snake in enumerate(snakes):
+            snake.fitness = fitness[brain]
+            snake.length = length[brain]
+            snake.age = age[brain]
+            snake.alive = alive[brain]
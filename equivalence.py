@@ -0,0 +1,87 @@
+import argparse
+import sys
+
+import numpy as np
+
+from environment import GOLDEN, SnakeEnvironment, splitmix
+from population import Population
+from snake import Snake, Grid
+from vector import Vector
+
+SEED = 1234
+
+
+# Stands in for a Snake's Random: the same numbers, in the same order, as one game of a seeded SnakeEnvironment draws
+class GameDraws(object):
+    def __init__(self, seed: int):
+        self.seed = np.array([seed], dtype=np.uint64)
+        self.draws = np.zeros(1, dtype=np.uint64)
+
+    def randint(self, low: int, high: int):
+        self.draws += np.uint64(1)
+        value = splitmix(self.seed + self.draws * GOLDEN)
+        return low + int(value[0] % np.uint64(high - low + 1))
+
+
+def trained_brains(count: int, generations: int, seed: int):
+    # Brains from a short seeded training run. Untrained ones mostly run straight into a wall; these eat, turn,
+    # cross their own path and starve, so most rules of the game come up.
+    population = Population(max(count, 300), Vector(12, 12), 10, True, seed=seed)
+    while population.generations <= generations:
+        population.move()
+    return [snake.brain for snake in population.snakes[0:count]]
+
+
+def compare(width: int, height: int, brains: list, length: int, seed: int):
+    # Play the same seeded games as Snake objects and in a SnakeEnvironment, one per brain, every snake starting
+    # `length` long. Returns {game: first tick the two disagreed on}.
+    games = len(brains)
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31, (games, 1))
+    environment = SnakeEnvironment(Grid(Vector(width, height)), brains, seeds=seeds)
+    environment.length[:] = length
+    snakes = [Snake(environment.grid, Vector(int(environment.x[game]), int(environment.y[game])), brains[game],
+                    length, GameDraws(int(seeds[game, 0])))
+              for game in range(0, games)]
+
+    mismatches = {}
+    tick = 0
+    while not environment.done():
+        environment.step()
+        tick += 1
+        for game, snake in enumerate(snakes):
+            snake.move()
+            state = (snake.alive, snake.position.x, snake.position.y, snake.length, snake.food.position.x,
+                     snake.food.position.y)
+            expected = (bool(environment.alive[game]), int(environment.x[game]), int(environment.y[game]),
+                        int(environment.length[game]), int(environment.food_x[game]), int(environment.food_y[game]))
+            if state != expected and game not in mismatches:
+                mismatches[game] = tick
+
+    for game, snake in enumerate(snakes):
+        if snake.alive or snake.fitness != environment.fitness[game]:
+            mismatches.setdefault(game, tick)
+    return mismatches
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Check SnakeEnvironment plays every game exactly as Snake does')
+    parser.add_argument('--games', type=int, default=200, help='games per grid')
+    parser.add_argument('--generations', type=int, default=20, help='generations to train the brains for')
+    parser.add_argument('--seed', type=int, default=SEED, help='seed for the brains and games')
+    options = parser.parse_args(args)
+
+    brains = trained_brains(options.games, options.generations, options.seed)
+    failed = False
+    # Square boards and not, so width and height can't be mixed up unnoticed, and long snakes from the start
+    for width, height, length in ((20, 20, 1), (7, 13, 1), (30, 12, 1), (20, 20, 10)):
+        mismatches = compare(width, height, brains, length, options.seed)
+        print(str(width) + "x" + str(height) + ", starting " + str(length) + " long: " +
+              str(len(brains) - len(mismatches)) + " of " + str(len(brains)) + " games match", flush=True)
+        for game, tick in sorted(mismatches.items())[0:5]:
+            print("MISMATCH game " + str(game) + " from tick " + str(tick), file=sys.stderr)
+        failed = failed or bool(mismatches)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
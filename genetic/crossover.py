@@ -5,11 +5,9 @@ import numpy as np
 
 # Simulated binary crossover https://engineering.purdue.edu/~sudhoff/ee630/Lecture04.pdf
 # https://pdfs.semanticscholar.org/b8ee/6b68520ae0291075cb1408046a7dff9dd9ad.pdf
-def SBC(mother: np.ndarray, father: np.ndarray, distribution_index):
-    randoms = np.random.random(mother.shape)
-    betas = np.empty(mother.shape)
-    betas[randoms <= 0.5] = 2 * randoms[randoms <= 0.5]
-    betas[randoms > 0.5] = 1.0 / (2.0 * (1.0 - randoms[randoms > 0.5]))
+def SBC(mother: np.ndarray, father: np.ndarray, distribution_index, rng=np.random):
+    randoms = rng.random(mother.shape)
+    betas = np.where(randoms <= 0.5, 2 * randoms, 1.0 / (2.0 * (1.0 - randoms)))
     betas **= 1.0 / (distribution_index + 1)
 
     child1 = 0.5 * ((1 + betas) * mother + (1 - betas) * father)
@@ -37,3 +35,35 @@ def random_crossover(mother: np.ndarray, father: np.ndarray, distribution_index)
     if random() > 0.5:
         return SBC(mother, father, distribution_index)
     return SPBC(mother, father)
+
+
+# Position of every gene within its segment, for chromosomes made of segments of the given sizes laid end to end
+def segment_index(sizes: np.ndarray):
+    segment_ids = np.repeat(np.arange(len(sizes)), sizes)
+    starts = np.cumsum(sizes) - sizes
+    return segment_ids, np.arange(int(np.sum(sizes))) - starts[segment_ids]
+
+
+# SPBC with its own cut in every segment. The flat cut point is uniform over the segment, the same as a random
+# row_cut / col_cut pair on the segment as a matrix. Leading axes of mother and father are independent pairs.
+def segmented_SPBC(mother: np.ndarray, father: np.ndarray, sizes: np.ndarray, rng=np.random):
+    segment_ids, offsets = segment_index(sizes)
+    cuts = rng.randint(1, sizes + 1, size=mother.shape[:-1] + (len(sizes),))
+    from_father = offsets < np.take(cuts, segment_ids, axis=-1)
+
+    child1 = np.where(from_father, father, mother)
+    child2 = np.where(from_father, mother, father)
+    return child1, child2
+
+
+# random_crossover for every segment at once
+def segmented_crossover(mother: np.ndarray, father: np.ndarray, distribution_index, sizes: np.ndarray,
+                        rng=np.random):
+    segment_ids = segment_index(sizes)[0]
+    sbc1, sbc2 = SBC(mother, father, distribution_index, rng)
+    spbc1, spbc2 = segmented_SPBC(mother, father, sizes, rng)
+    use_sbc = np.take(rng.random(mother.shape[:-1] + (len(sizes),)) > 0.5, segment_ids, axis=-1)
+
+    child1 = np.where(use_sbc, sbc1, spbc1)
+    child2 = np.where(use_sbc, sbc2, spbc2)
+    return child1, child2
@@ -2,11 +2,11 @@ import numpy as np
 
 
 # Gaussian mutation. https://github.com/Chrispresso/SnakeAI/blob/master/genetic_algorithm/mutation.py
-def gaussian(chromosome: np.ndarray, chance=0, scale=0):
-    genes_to_mutate = np.random.random(chromosome.shape) < chance
-    mutation = np.random.normal(size=chromosome.shape)
-    mutation[genes_to_mutate] *= scale
+def gaussian(chromosome: np.ndarray, chance=0, scale=0, rng=np.random):
+    genes_to_mutate = rng.random(chromosome.shape) < chance
+    # Only draw noise for the genes that mutate
+    mutation = rng.normal(size=np.count_nonzero(genes_to_mutate)) * scale
 
-    chromosome[genes_to_mutate] += mutation[genes_to_mutate]
+    chromosome[genes_to_mutate] += mutation
 
     return chromosome
@@ -1,53 +1,165 @@
+import math
+import queue
+import threading
+import time
+
 import matplotlib
+import numpy as np
 import pygame
 from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
 import matplotlib.backends.backend_agg as agg
 
 
+# One chart of history fields. The lines persist and only their data changes; the axes are only laid out again when
+# the data outgrows them, otherwise the lines are blitted over a cached background.
 class Graph(object):
-    def __init__(self):
-        matplotlib.style.use("seaborn")
+    def __init__(self, series: dict, xlabel: str, ylabel: str, yscale: str = "log", max_points: int = 500):
+        # series: legend label -> history field
         matplotlib.use("Agg")
+        matplotlib.style.use("seaborn")
         matplotlib.rcParams.update({'font.size': 11})
-        self.fig = plt.figure(figsize=[4, 2])
-
-        self.ax = self.fig.add_subplot(111)
-        self.ax.set_yscale("log")
-
+        self.series = series
+        self.yscale = yscale
+        self.max_points = max_points
+        self.fig = Figure(figsize=[4, 2])
         self.canvas = agg.FigureCanvasAgg(self.fig)
-        self.fig.tight_layout()
-
-    def draw(self, data, xlabel: str, ylabel: str, yscale: str = "log"):
-        self.ax.clear()
 
+        self.ax = self.fig.add_subplot(111)
         self.ax.set_xlabel(xlabel, color='k', labelpad=10)
         self.ax.set_ylabel(ylabel, rotation=270, color='k', labelpad=15)
         self.ax.set_yscale(yscale)
 
-        self.ax.plot(data)
-        self.fig.tight_layout()
-        self.canvas.draw()
-        raw_data = self.canvas.get_renderer().tostring_rgb()
-        size = self.canvas.get_width_height()
+        self.lines = {}
+        if len(series) == 1:
+            self.lines[next(iter(series))], = self.ax.plot([], [], animated=True)
+        else:
+            palette = plt.get_cmap('Set1')
+            for num, name in enumerate(series, 1):
+                self.lines[name], = self.ax.plot([], [], marker='', color=palette(num), linewidth=1, alpha=0.9,
+                                                 label=name, animated=True)
+            self.ax.legend(loc=2, ncol=2)
 
-        return pygame.image.fromstring(raw_data, size, "RGB")
+        self.data = {name: [] for name in series}
+        self.background = None
+        self.reset()
 
-    def draw_multiple(self, datas: dict, xlabel: str, ylabel: str, yscale: str = "log"):
-        self.ax.clear()
+    def reset(self):
+        for values in self.data.values():
+            values.clear()
+        self.ax.set_xlim(0, 16)
+        self.ax.set_ylim(1 if self.yscale == "log" else 0, 10)
+        self.background = None
 
-        self.ax.set_xlabel(xlabel, color='k', labelpad=10)
-        self.ax.set_ylabel(ylabel, rotation=270, color='k', labelpad=15)
-        self.ax.set_yscale(yscale)
-        palette = plt.get_cmap('Set1')
-        num = 0
-        for name, data in datas.items():
-            num += 1
-            self.ax.plot(data, marker='', color=palette(num), linewidth=1, alpha=0.9, label=name)
-
-        self.ax.legend(loc=2, ncol=2)
-        self.fig.tight_layout()
-        self.canvas.draw()
-        raw_data = self.canvas.get_renderer().tostring_rgb()
-        size = self.canvas.get_width_height()
-
-        return pygame.image.fromstring(raw_data, size, "RGB")
+    def extend(self, entries: list):
+        for entry in entries:
+            for name, field in self.series.items():
+                self.data[name].append(entry[field])
+
+    def sample(self, values: list):
+        # Every nth point, always ending on the latest one
+        values = np.asarray(values, dtype=float)
+        keep = np.arange(0, len(values), max(1, math.ceil(len(values) / self.max_points)))
+        if len(keep) and keep[-1] != len(values) - 1:
+            keep = np.append(keep, len(values) - 1)
+        return keep, values[keep]
+
+    def fit(self):
+        # Grow the axes in big steps, so they rarely need laying out again
+        count = max(len(values) for values in self.data.values())
+        values = np.concatenate([np.asarray(values, dtype=float) for values in self.data.values()])
+        if self.yscale == "log":
+            values = values[values > 0]
+        changed = False
+
+        right = self.ax.get_xlim()[1]
+        if count > right:
+            self.ax.set_xlim(0, 2 ** math.ceil(math.log2(count)))
+            changed = True
+
+        if len(values):
+            bottom, top = self.ax.get_ylim()
+            low = values.min()
+            high = values.max()
+            if self.yscale == "log":
+                if low < bottom or high > top:
+                    self.ax.set_ylim(10 ** math.floor(math.log10(min(low, bottom))),
+                                     10 ** math.ceil(math.log10(max(high, top) * 1.01)))
+                    changed = True
+            elif low < bottom or high > top:
+                bottom = min(bottom, low if low < 0 else 0)
+                self.ax.set_ylim(bottom, max(top, high) * 2)
+                changed = True
+        return changed
+
+    def render(self):
+        if self.fit() or self.background is None:
+            self.fig.tight_layout()
+            self.canvas.draw()
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        else:
+            self.canvas.restore_region(self.background)
+
+        for name, line in self.lines.items():
+            line.set_data(*self.sample(self.data[name]))
+            self.ax.draw_artist(line)
+
+        return pygame.image.fromstring(bytes(self.canvas.buffer_rgba()), self.canvas.get_width_height(), "RGBA")
+
+
+# Draws graphs on a background thread; the game loop submits new history entries and picks up finished surfaces
+class GraphRenderer(object):
+    def __init__(self, graphs: dict):
+        self.graphs = graphs
+        self.surfaces = {}
+        self.lock = threading.Lock()
+        # Time spent drawing, and how many draws, since the last take_timing()
+        self.seconds = 0.0
+        self.draws = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, entries: list, reset: bool = False):
+        self.queue.put((list(entries), reset))
+
+    def surface(self, name: str):
+        with self.lock:
+            return self.surfaces.get(name)
+
+    def run(self):
+        while True:
+            entries, reset = self.queue.get()
+            if entries is None:
+                return
+            pending = [(entries, reset)]
+            # Catch up on everything already queued, then draw once
+            while not self.queue.empty():
+                pending.append(self.queue.get())
+            for entries, reset in pending:
+                if entries is None:
+                    return
+                for graph in self.graphs.values():
+                    if reset:
+                        graph.reset()
+                    graph.extend(entries)
+
+            started = time.perf_counter()
+            surfaces = {name: graph.render() for name, graph in self.graphs.items()}
+            seconds = time.perf_counter() - started
+            with self.lock:
+                self.surfaces.update(surfaces)
+                self.seconds += seconds
+                self.draws += 1
+
+    def take_timing(self):
+        # Seconds spent drawing and the number of draws since the last call
+        with self.lock:
+            timing = (self.seconds, self.draws)
+            self.seconds = 0.0
+            self.draws = 0
+        return timing
+
+    def close(self):
+        self.queue.put((None, False))
+        self.thread.join()
@@ -0,0 +1,176 @@
+import argparse
+import time
+
+import quantize
+from archive import HallOfFame
+from islands import Archipelago
+from population import Population
+from save import Checkpoint, CheckpointWriter
+from vector import Vector
+
+
+# Trains a population at full simulation speed, with no display at all
+class HeadlessTrainer(object):
+    def __init__(self, population: Population, generations=None, time_limit=None, checkpoint_every=0,
+                 checkpoint_path='saved-population.ckpt', show_profile=False):
+        self.population = population
+        # Print each generation's per phase timings too
+        self.show_profile = show_profile
+        self.generations = generations
+        self.time_limit = time_limit
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_path = checkpoint_path
+        # Checkpoints are written in the background while training carries on
+        self.saver = CheckpointWriter()
+        self.start_time = time.time()
+        self.start_generation = population.generations
+        self.population.on_generation = self.on_generation
+
+    def completed_generations(self):
+        return self.population.generations - self.start_generation
+
+    def finished(self):
+        if self.generations is not None and self.completed_generations() >= self.generations:
+            return True
+        if self.time_limit is not None and time.time() - self.start_time >= self.time_limit:
+            return True
+        return False
+
+    def on_generation(self):
+        stats = self.population.history[-1]
+        print("Generation: " + str(self.population.generations - 1) +
+              " | Top fitness: " + str(stats['top_fitness']) +
+              " | Avg fitness: " + str(stats['avg_fitness']) +
+              " | Top length: " + str(stats['top_length']) +
+              " | Avg length: " + str(stats['avg_length']) +
+              " | Best length: " + str(self.population.best_length) +
+              " | Seconds: " + str(stats['duration']) +
+              (" | Cache hits: " + str(stats['cache_hits']) + "/" + str(stats['cache_hits'] + stats['cache_misses'])
+               if 'cache_hits' in stats else ""), flush=True)
+        if self.show_profile:
+            print("    " + " | ".join(phase + ": " + str(timing['seconds']) + "s / " + str(timing['calls'])
+                                      for phase, timing in stats['profile'].items()), flush=True)
+
+        if self.checkpoint_every and self.completed_generations() % self.checkpoint_every == 0:
+            self.checkpoint()
+
+    def checkpoint(self):
+        profiler = self.population.profiler
+        started = profiler.now()
+        self.saver.save(self.checkpoint_path, *self.population.checkpoint_data())
+        profiler.add('checkpointing', started)
+
+    def run(self):
+        while not self.finished():
+            self.population.move()
+
+        if self.checkpoint_every:
+            self.checkpoint()
+        self.saver.close()
+        self.population.close()
+
+
+def aggregation(text: str):
+    # 'mean', 'min' or a quantile between 0 and 1
+    if text in ('mean', 'min'):
+        return text
+    quantile = float(text)
+    if not 0 <= quantile <= 1:
+        raise argparse.ArgumentTypeError('quantile must be between 0 and 1')
+    return quantile
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Train snakes without opening a window')
+    parser.add_argument('--snakes', type=int, default=1100, help='population size')
+    parser.add_argument('--width', type=int, default=20, help='grid width in cells')
+    parser.add_argument('--height', type=int, default=20, help='grid height in cells')
+    parser.add_argument('--generations', type=int, default=None, help='stop after this many generations')
+    parser.add_argument('--time', type=float, default=None, help='stop after this many seconds')
+    parser.add_argument('--checkpoint-every', type=int, default=0,
+                        help='save the population every N generations (0 disables checkpoints)')
+    parser.add_argument('--checkpoint', default='saved-population.ckpt', help='checkpoint file')
+    parser.add_argument('--resume', action='store_true', help='load the checkpoint file before training')
+    parser.add_argument('--hall-of-fame', default=None, help='archive the top genomes of every generation here')
+    parser.add_argument('--hall-of-fame-size', type=int, default=10, help='genomes archived per generation')
+    parser.add_argument('--seed-from-hall-of-fame', type=int, default=0,
+                        help='start with the best N genomes from the hall of fame archive')
+    parser.add_argument('--seed', type=int, default=None, help='seed for a reproducible run')
+    parser.add_argument('--vectorized', action='store_true', help='play games in a SnakeEnvironment')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='play each generation across this many processes (0 plays it in this one)')
+    parser.add_argument('--profile', action='store_true', help='print time spent per phase every generation')
+    parser.add_argument('--cprofile', type=int, nargs=2, default=None, metavar=('FIRST', 'LAST'),
+                        help='run cProfile from generation FIRST to generation LAST')
+    parser.add_argument('--cprofile-output', default='generations.pstats', help='cProfile stats file')
+    parser.add_argument('--islands', type=int, default=0,
+                        help='evolve this many populations in their own processes, swapping their best genomes')
+    parser.add_argument('--migration-interval', type=int, default=5, help='generations between island migrations')
+    parser.add_argument('--migrants', type=int, default=5, help='genomes each island sends per migration')
+    parser.add_argument('--topology', choices=['ring', 'all'], default='ring',
+                        help='which islands migrants go to: the next one, or every other one')
+    parser.add_argument('--episodes', type=int, default=1, help='games each brain plays per generation')
+    parser.add_argument('--aggregate', type=aggregation, default='mean',
+                        help="how a brain's episodes make up its fitness: mean, min or a quantile such as 0.25")
+    parser.add_argument('--seeding', choices=['random', 'fixed', 'genome'], default='random',
+                        help='episode seeds: random, the same for every brain, or one set per genome; the last two '
+                             'remember results so unchanged genomes are not played again')
+    parser.add_argument('--cache-size', type=int, default=4096, help='results remembered with fixed or genome seeding')
+    parser.add_argument('--precision', choices=['float64', 'float32'], default='float64',
+                        help='dtype of every genome and forward pass')
+    parser.add_argument('--check-quantized', action='store_true',
+                        help='record games, and at the end check an int8 copy of the best brain replays its best game')
+    options = parser.parse_args(args)
+    if options.islands:
+        unsupported = [option for option, value in (('--workers', options.workers),
+                                                    ('--hall-of-fame', options.hall_of_fame),
+                                                    ('--seed-from-hall-of-fame', options.seed_from_hall_of_fame),
+                                                    ('--profile', options.profile),
+                                                    ('--cprofile', options.cprofile),
+                                                    ('--check-quantized', options.check_quantized)) if value]
+        if unsupported:
+            parser.error(', '.join(unsupported) + ' cannot be used with --islands')
+    if options.check_quantized and (options.vectorized or options.workers):
+        # Only Snake objects played here record their games
+        parser.error('--check-quantized cannot be used with --vectorized or --workers')
+    return options
+
+
+def main(args=None):
+    options = parse_args(args)
+    if options.islands:
+        # Each island saves to and resumes from the checkpoint path plus '.island<number>'
+        Archipelago(options.islands, options.snakes, options.width, options.height, options.generations, options.time,
+                    options.migration_interval, options.migrants, options.topology, options.vectorized, options.seed,
+                    options.checkpoint, options.episodes, options.aggregate, options.seeding, options.cache_size,
+                    options.checkpoint_every, options.resume, options.precision).run()
+        return
+
+    population = Population(options.snakes, Vector(options.width, options.height), 10, options.vectorized,
+                            options.workers, options.seed, options.check_quantized, options.precision,
+                            options.episodes, options.aggregate, options.seeding, options.cache_size)
+    if options.resume:
+        population.load_checkpoint(*Checkpoint(options.checkpoint).open())
+    if options.hall_of_fame:
+        hall_of_fame = HallOfFame(options.hall_of_fame, population.snakes[0].brain.layout, options.hall_of_fame_size)
+        population.hall_of_fame = hall_of_fame
+        if options.seed_from_hall_of_fame:
+            population.reseed([hall_of_fame.brain(record)
+                               for record in hall_of_fame.best(options.seed_from_hall_of_fame)])
+    if options.cprofile:
+        population.profiler.profile_generations(options.cprofile[0], options.cprofile[1], options.cprofile_output)
+        population.profiler.generation(population.generations)
+    trainer = HeadlessTrainer(population, options.generations, options.time, options.checkpoint_every,
+                              options.checkpoint, options.profile)
+    trainer.run()
+
+    if options.check_quantized and population.best_trajectory is not None:
+        brain = population.all_time_best_snake.brain
+        for name, (matches, steps) in quantize.check(population.best_trajectory, brain).items():
+            print(name + " brain picks the recorded move on " + str(matches) + " of " + str(steps) + " steps")
+        print("Weights: " + str(brain.genome.nbytes) + " bytes, int8: " +
+              str(quantize.QuantizedNetwork(brain).nbytes()) + " bytes")
+
+
+if __name__ == '__main__':
+    main()
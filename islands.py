@@ -0,0 +1,158 @@
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+from neuralnetwork import NeuralNetwork
+from population import Population
+from save import Checkpoint, CheckpointWriter
+from vector import Vector
+
+
+def neighbours(index: int, islands: int, topology: str):
+    # Islands that receive migrants from island index
+    if islands < 2:
+        return []
+    if topology == 'ring':
+        return [(index + 1) % islands]
+    if topology == 'all':
+        return [other for other in range(0, islands) if other != index]
+    raise ValueError('Unknown migration topology ' + topology)
+
+
+# Process side: evolve one population, sending its best genomes to its neighbours every so often and taking in
+# whatever genomes they send back
+def island(index: int, settings: dict, inboxes: list, reports):
+    seed = settings['seed']
+    population = Population(settings['snakes'], Vector(settings['width'], settings['height']), 10,
+                            settings['vectorized'], seed=None if seed is None else seed + index,
+                            episodes=settings['episodes'], aggregation=settings['aggregation'],
+                            precision=settings['precision'], seeding=settings['seeding'],
+                            cache_size=settings['cache_size'])
+    checkpoint = None
+    if settings['checkpoint']:
+        checkpoint = settings['checkpoint'] + '.island' + str(index)
+        if settings['resume']:
+            population.load_checkpoint(*Checkpoint(checkpoint).open())
+    # Checkpoints are written in the background while the island carries on
+    saver = CheckpointWriter()
+    layout = population.snakes[0].brain.layout
+    inbox = inboxes[index]
+    outboxes = [inboxes[other] for other in neighbours(index, len(inboxes), settings['topology'])]
+    start_time = time.time()
+    start_generation = population.generations
+
+    def on_generation():
+        generation = population.generations - 1
+        # Arrivals join the next generation bred
+        arrived = []
+        while True:
+            try:
+                arrived.extend(inbox.get_nowait())
+            except queue.Empty:
+                break
+        population.immigrate([NeuralNetwork.from_genome(layout, genome) for genome in arrived])
+
+        if outboxes and generation % settings['migration_interval'] == 0:
+            # The new generation starts with last generation's best, best first
+            migrants = np.stack([snake.brain.genome for snake in population.snakes[0:settings['migrants']]])
+            for outbox in outboxes:
+                outbox.put(migrants)
+
+        every = settings['checkpoint_every']
+        if checkpoint and every and (population.generations - start_generation) % every == 0:
+            saver.save(checkpoint, *population.checkpoint_data())
+
+        reports.put((index, generation, population.history[-1], population.best_length, len(arrived)))
+
+    def finished():
+        generations = settings['generations']
+        if generations is not None and population.generations - start_generation >= generations:
+            return True
+        return settings['time'] is not None and time.time() - start_time >= settings['time']
+
+    population.on_generation = on_generation
+    while not finished():
+        population.move()
+
+    if checkpoint and settings['checkpoint_every']:
+        saver.save(checkpoint, *population.checkpoint_data())
+    saver.close()
+    population.close()
+    # Migrants nobody will read any more mustn't keep this process from exiting
+    for outbox in outboxes:
+        outbox.cancel_join_thread()
+    reports.put((index, None, None, population.best_length, 0))
+
+
+# Runs several populations in their own processes. Each evolves on its own, and every migration_interval generations
+# sends copies of its best `migrants` genomes to its neighbours in the topology ('ring' or 'all').
+# Island number i checkpoints to the checkpoint path plus '.island<i>', every checkpoint_every generations and when
+# it finishes (never with checkpoint_every 0), and with resume starts from that file.
+class Archipelago(object):
+    def __init__(self, islands: int, snakes: int, width: int, height: int, generations=None, time_limit=None,
+                 migration_interval=5, migrants=5, topology='ring', vectorized=False, seed=None, checkpoint=None,
+                 episodes=1, aggregation='mean', seeding='random', cache_size=4096, checkpoint_every=0, resume=False,
+                 precision='float64'):
+        # Fail on a bad topology here rather than in every island
+        neighbours(0, islands, topology)
+        self.islands = islands
+        self.settings = {
+            'snakes': snakes,
+            'width': width,
+            'height': height,
+            'generations': generations,
+            'time': time_limit,
+            'migration_interval': migration_interval,
+            'migrants': migrants,
+            'topology': topology,
+            'vectorized': vectorized,
+            'seed': seed,
+            'checkpoint': checkpoint,
+            'checkpoint_every': checkpoint_every,
+            'resume': resume,
+            'precision': precision,
+            'episodes': episodes,
+            'aggregation': aggregation,
+            'seeding': seeding,
+            'cache_size': cache_size
+        }
+        self.best_length = 0
+
+    def run(self):
+        inboxes = [multiprocessing.Queue() for i in range(0, self.islands)]
+        reports = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=island, args=(index, self.settings, inboxes, reports))
+                     for index in range(0, self.islands)]
+        for process in processes:
+            process.start()
+
+        running = self.islands
+        while running:
+            try:
+                index, generation, stats, best_length, arrived = reports.get(timeout=1)
+            except queue.Empty:
+                for process in processes:
+                    if process.exitcode:
+                        for other in processes:
+                            other.terminate()
+                        raise RuntimeError('An island process failed with exit code ' + str(process.exitcode))
+                continue
+            self.best_length = max(self.best_length, best_length)
+            if generation is None:
+                running -= 1
+                continue
+            self.on_generation(index, generation, stats, best_length, arrived)
+
+        for process in processes:
+            process.join()
+
+    def on_generation(self, index: int, generation: int, stats: dict, best_length: int, arrived: int):
+        print("Island: " + str(index) +
+              " | Generation: " + str(generation) +
+              " | Top fitness: " + str(stats['top_fitness']) +
+              " | Avg fitness: " + str(stats['avg_fitness']) +
+              " | Top length: " + str(stats['top_length']) +
+              " | Best length: " + str(best_length) +
+              " | Migrants in: " + str(arrived), flush=True)
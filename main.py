@@ -1,10 +1,12 @@
 import time
 
-from graph import Graph
+from graph import Graph, GraphRenderer
 from neuralnetwork import *
 from population import Population
-from renderer import Renderer, NetworkDisplay
-from save import SaveState
+from renderer import Frame, Renderer, NetworkDisplay
+from replay import Replay
+from save import Checkpoint, CheckpointWriter
+from simulation import Simulation
 
 
 class Game(object):
@@ -17,41 +19,91 @@ class Game(object):
         self.clock = pygame.time.Clock()
 
         self.font = pygame.font.SysFont('bahnschrift', 15)
-        self.graph_writer = Graph()
-        self.fitness_graph = None
-        self.length_graph = None
-        self.duration_graph = None
-        self.population = Population(1100, Vector(20, 20), 10)
-        self.pause = False
-        self.renderer = Renderer(pygame, self.display, self.population, self.population.cell_size, Vector(50, 50))
+        self.graphs = GraphRenderer({
+            "fitness": Graph({"top": "top_fitness", "avg": "avg_fitness"}, "Generation", "Fitness", "log"),
+            "length": Graph({"top": "top_length", "avg": "avg_length"}, "Generation", "Length", "linear"),
+            "duration": Graph({"duration": "duration"}, "Generation", "Seconds", "linear")
+        })
+        # History entries already handed to the graphs
+        self.graphed = 0
+        self.population = Population(1100, Vector(20, 20), 10, record=True)
+        # Display frames per second. The simulation starts flat out; ticks_per_frame is the cap that '-' and '0'
+        # switch back to.
+        self.fps = 60
+        self.ticks_per_frame = 1
+        # Draw only the HUD text and graphs, leaving the simulation all the time
+        self.detached = False
+        self.simulation = None
+        self.renderer = Renderer(pygame, self.display, self.population.cell_size, Vector(50, 50))
         self.start_time = time.time()
-        self.backup_saver = None
+        # Checkpoints are written in the background; only the newest few history backups are kept
+        self.saver = CheckpointWriter()
+        self.backup_saver = CheckpointWriter(keep=3)
+        # Replay of the best game so far, shown instead of the live snakes while it plays
+        self.replay = None
+        # Show the last generation's per phase timings
+        self.show_profile = False
+
+    def update_graphs(self, reset=False):
+        # Hand the graphs only the history they haven't seen; they're drawn off the game loop
+        history = self.population.history
+        self.graphs.submit(history if reset else history[self.graphed:], reset)
+        self.graphed = len(history)
 
     def refresh_graphs(self):
-        self.fitness_graph = self.graph_writer.draw_multiple(
-            {"top": [x['top_fitness'] for x in self.population.history],
-             "avg": [x['avg_fitness'] for x in self.population.history]}, "Generation",
-            "Fitness", "log")
-        self.length_graph = self.graph_writer.draw_multiple(
-            {"top": [x['top_length'] for x in self.population.history],
-             "avg": [x['avg_length'] for x in self.population.history]}, "Generation",
-            "Length", "linear")
-        self.duration_graph = self.graph_writer.draw([x['duration'] for x in self.population.history], "Generation",
-                                                     "Seconds", "linear")
+        profiler = self.population.profiler
+        self.update_graphs()
+        # Graphs are drawn on their own thread; the drawing it has done since last time is reported here
+        profiler.charge('graphs', *self.graphs.take_timing())
+        started = profiler.now()
 
         # Write history backup
         if self.population.best_length > 10:
-            if self.backup_saver:
-                self.backup_saver.delete()
-            self.backup_saver = SaveState(
-                'history/saved-' + str(self.population.generations) + ' - ' + str(
-                    self.population.best_length) + ' - ' + str(int(self.population.start_time)) + '.dat')
-            self.backup_saver.save(self.population.save_data())
+            path = 'history/saved-' + str(self.population.generations) + ' - ' + str(
+                self.population.best_length) + ' - ' + str(int(self.population.start_time)) + '.ckpt'
+            self.backup_saver.save(path, *self.population.checkpoint_data())
+            profiler.add('checkpointing', started)
+
+    def draw_profile(self, frame: Frame):
+        if not frame.profile:
+            return
+        for line, (phase, timing) in enumerate(frame.profile.items()):
+            value = self.font.render(
+                phase + ": " + str(round(timing['seconds'], 2)) + "s / " + str(timing['calls']), True,
+                (255, 255, 255))
+            self.display.blit(value, [1200, 660 + line * 20])
+
+    def draw_speed(self):
+        if self.simulation.paused:
+            speed = "paused"
+        elif self.simulation.ticks_per_frame:
+            speed = str(self.simulation.ticks_per_frame) + " ticks/frame"
+        else:
+            speed = "max speed"
+        if self.detached:
+            speed += ", rendering detached"
+        value = self.font.render("Simulation: " + speed, True, (255, 255, 255))
+        self.display.blit(value, [1200, 0])
+
+    def change_speed(self, key):
+        simulation = self.simulation
+        if key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):
+            if simulation.ticks_per_frame:
+                simulation.set_ticks_per_frame(simulation.ticks_per_frame * 2)
+        elif key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+            simulation.set_ticks_per_frame(max(1, simulation.ticks_per_frame // 2) if simulation.ticks_per_frame
+                                           else self.ticks_per_frame)
+        elif key == pygame.K_0:
+            if simulation.ticks_per_frame:
+                self.ticks_per_frame = simulation.ticks_per_frame
+                simulation.set_ticks_per_frame(0)
+            else:
+                simulation.set_ticks_per_frame(self.ticks_per_frame)
 
     def gameLoop(self):
         exit_game = False
 
-        save_state = SaveState('saved-population.dat')
+        save_state = Checkpoint('saved-population.ckpt')
 
         # Display the first snakes brain in the HUD
         network_display = NetworkDisplay(self.population.active_snake.brain, Vector(700, 100), Vector(500, 900), 10)
@@ -59,57 +111,87 @@ class Game(object):
         self.refresh_graphs()
 
         self.population.on_generation = self.refresh_graphs
+        # The population trains on its own thread from here on; look at it only while holding simulation.lock
+        self.simulation = Simulation(self.population, 0)
 
         while not exit_game:
-            network_display.network = self.population.active_snake.brain
+            self.simulation.frame()
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     exit_game = True
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_F1:
-                        save_state.save(self.population.save_data())
+                        with self.simulation.lock:
+                            self.saver.save(save_state.path, *self.population.checkpoint_data())
                     elif event.key == pygame.K_SPACE:
-                        if self.pause:
-                            self.pause = False
-                        else:
-                            self.pause = True
+                        self.simulation.toggle_pause()
+                    elif event.key == pygame.K_d:
+                        self.detached = not self.detached
+                    elif event.key == pygame.K_F3:
+                        if self.population.best_trajectory:
+                            self.replay = Replay(self.population.best_trajectory)
+                    elif event.key == pygame.K_F4:
+                        self.show_profile = not self.show_profile
                     elif event.key == pygame.K_F2:
-                        self.start_time = time.time()
-                        self.population.load_data(save_state.open())
-                        network_display.network = self.population.active_snake.brain
+                        self.saver.flush()
+                        with self.simulation.lock:
+                            self.start_time = time.time()
+                            self.population.load_checkpoint(*save_state.open())
+                            self.update_graphs(True)
+                    else:
+                        self.change_speed(event.key)
 
             self.display.fill((0, 0, 0))
 
-            value = self.font.render(
-                "Live snakes: " + str(self.population.live_snakes()) + "/" + str(len(self.population.snakes)),
-                True, (255, 255, 255))
+            # Hold the simulation only for as long as it takes to copy out what this frame shows
+            with self.simulation.lock:
+                frame = Frame(self.population, not self.detached)
+
+            value = self.font.render("Live snakes: " + str(frame.live_snakes) + "/" + str(frame.games), True,
+                                     (255, 255, 255))
             self.display.blit(value, [200, 0])
 
-            value = self.font.render("Best score: " + str(int(self.population.best_score)), True, (255, 255, 255))
+            value = self.font.render("Best score: " + str(int(frame.best_score)), True, (255, 255, 255))
             self.display.blit(value, [400, 0])
 
-            value = self.font.render("Generation: " + str(self.population.generations), True, (255, 255, 255))
+            value = self.font.render("Generation: " + str(frame.generations), True, (255, 255, 255))
             self.display.blit(value, [800, 0])
 
-            value = self.font.render(
-                "Length: " + str(self.population.active_snake.length) + " / " + str(self.population.best_length), True,
-                (255, 255, 255))
+            value = self.font.render("Length: " + str(frame.length) + " / " + str(frame.best_length), True,
+                                     (255, 255, 255))
             self.display.blit(value, [950, 0])
 
-            if not self.pause:
-                self.renderer.draw()
-            self.population.move()
-
-            network_display.draw(pygame, self.display)
-
-            self.display.blit(self.fitness_graph, (1200, 50))
-            self.display.blit(self.length_graph, (1200, 251))
-            self.display.blit(self.duration_graph, (1200, 452))
+            self.draw_speed()
+            if self.show_profile:
+                self.draw_profile(frame)
+
+            if not self.detached:
+                started = self.population.profiler.now()
+                if self.replay:
+                    self.renderer.draw_replay(self.replay)
+                    if not self.replay.step():
+                        self.replay = None
+                else:
+                    self.renderer.draw(frame)
+
+                network_display.network = frame.brain
+                network_display.draw(pygame, self.display, frame.states)
+                with self.simulation.lock:
+                    self.population.profiler.add('rendering', started)
+
+            for name, position in (("fitness", (1200, 50)), ("length", (1200, 251)), ("duration", (1200, 452))):
+                surface = self.graphs.surface(name)
+                if surface:
+                    self.display.blit(surface, position)
 
             pygame.display.update()
-            self.clock.tick()
+            self.clock.tick(self.fps)
 
+        self.simulation.stop()
+        self.graphs.close()
+        self.saver.close()
+        self.backup_saver.close()
         pygame.quit()
         quit()
 
@@ -0,0 +1,29 @@
+from collections import OrderedDict
+from random import Random
+
+
+def genome_seeds(fingerprint: str, episodes: int):
+    # Episode seeds that belong to a genome (by NeuralNetwork.fingerprint), so it plays the same games whenever it
+    # comes round again
+    random = Random(fingerprint)
+    return [random.getrandbits(32) for episode in range(0, episodes)]
+
+
+# The results of the last `size` (genome, episode seeds) pairs played. A genome that plays the same seeds again would
+# play exactly the same games, so its results are taken from here instead.
+class FitnessCache(object):
+    def __init__(self, size: int):
+        self.size = size
+        self.results = OrderedDict()
+
+    def get(self, key):
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.size:
+            self.results.popitem(last=False)
@@ -1,10 +1,11 @@
 import copy
+import hashlib
 
 import numpy as np
 import pygame
 
-from genetic.activation import Sigmoid
-from genetic.crossover import SBC, random_crossover
+from genetic.activation import ReLU, Sigmoid
+from genetic.crossover import segmented_crossover
 from genetic.mutation import gaussian
 from vector import Vector
 
@@ -16,11 +17,11 @@ class Layer(object):
         self.weights = weights
         self.biases = biases
         self.activation = activation
-        self.output = []
+        self.output = np.zeros((1, neurons))
 
     @classmethod
-    def random_layer(cls, inputs: int, neurons: int, activation):
-        weights = np.random.standard_normal((inputs, neurons))
+    def random_layer(cls, inputs: int, neurons: int, activation, rng=np.random):
+        weights = rng.standard_normal((inputs, neurons))
         biases = np.zeros((1, neurons))
 
         return cls(inputs, neurons, activation, weights, biases)
@@ -33,47 +34,115 @@ class Layer(object):
         return self.output[0][neuron]
 
     def copy(self):
-        return Layer(self.inputs, self.neurons, self.activation, copy.deepcopy(self.weights),
-                     copy.deepcopy(self.biases))
-
-    def mutate(self, rate, scale):
-        self.biases = gaussian(self.biases, rate, scale)
-        self.biases.clip(-1, 1, self.biases)
-        self.weights = gaussian(self.weights, rate, scale)
-        self.weights.clip(-1, 1, self.weights)
-
-    def crossover(self, father):
-        c1_weights, c2_weights = random_crossover(self.weights, father.weights, 100)
-        c1_biases, c2_biases = random_crossover(self.biases, father.biases, 100)
-
-        c1 = Layer(self.inputs, self.neurons, self.activation, c1_weights, c1_biases)
-        c2 = Layer(self.inputs, self.neurons, self.activation, c2_weights, c2_biases)
-
-        return c1, c2
+        return type(self)(self.inputs, self.neurons, self.activation, copy.deepcopy(self.weights),
+                          copy.deepcopy(self.biases))
 
 
+# Passes the senses straight through, so it has no weights or biases
 class InputLayer(Layer):
+    @classmethod
+    def random_layer(cls, inputs: int, neurons: int, activation, rng=np.random):
+        return cls(inputs, neurons, activation, None, None)
+
     def forward(self, inputs):
         self.output = [inputs]
         return self.output
 
 
+LAYER_TYPES = {'Layer': Layer, 'InputLayer': InputLayer}
+ACTIVATIONS = {'ReLU': ReLU, 'Sigmoid': Sigmoid}
+
+
+# Where each layer's weights and biases live inside a flat genome
+class GenomeLayout(object):
+    def __init__(self, layers: list):
+        # (layer class, inputs, neurons, activation) per layer
+        self.layers = layers
+        # (start, stop, shape) of every weight and bias matrix, in genome order
+        self.segments = []
+        self.size = 0
+        for layer_class, inputs, neurons, activation in layers:
+            if layer_class is InputLayer:
+                continue
+            for shape in ((inputs, neurons), (1, neurons)):
+                start = self.size
+                self.size += shape[0] * shape[1]
+                self.segments.append((start, self.size, shape))
+        self.segment_sizes = np.array([stop - start for start, stop, shape in self.segments])
+
+    @classmethod
+    def of(cls, layers: list):
+        return cls([(type(layer), layer.inputs, layer.neurons, layer.activation) for layer in layers])
+
+    @classmethod
+    def from_description(cls, description: list):
+        return cls([(LAYER_TYPES[layer_type], inputs, neurons, ACTIVATIONS[activation]())
+                    for layer_type, inputs, neurons, activation in description])
+
+    def describe(self):
+        # Plain lists of names and sizes, for checkpoint metadata
+        return [[layer_class.__name__, inputs, neurons, type(activation).__name__]
+                for layer_class, inputs, neurons, activation in self.layers]
+
+    def segment_views(self, genomes: np.ndarray):
+        # Zero-copy views of every segment, for one genome or a matrix with one genome per row
+        batch = genomes.shape[:-1]
+        return [genomes[..., start:stop].reshape(batch + shape) for start, stop, shape in self.segments]
+
+    def build(self, genome: np.ndarray):
+        views = iter(self.segment_views(genome))
+        layers = []
+        for layer_class, inputs, neurons, activation in self.layers:
+            if layer_class is InputLayer:
+                layers.append(layer_class(inputs, neurons, activation, None, None))
+            else:
+                layers.append(layer_class(inputs, neurons, activation, next(views), next(views)))
+        return layers
+
+
+# All of a network's parameters sit in one contiguous genome array; the layers only hold views into it
 class NeuralNetwork(object):
     def __init__(self, layers):
         self.layers = layers
+        self.pack()
 
     @classmethod
-    def create(cls, inputs: int, hidden_layers: list, outputs: int, activation):
-        layers = [InputLayer.random_layer(inputs, inputs, activation)]
+    def create(cls, inputs: int, hidden_layers: list, outputs: int, activation, rng=np.random):
+        layers = [InputLayer.random_layer(inputs, inputs, activation, rng)]
         next_inputs = inputs
         for layer_neurons in hidden_layers:
-            layers.append(Layer.random_layer(next_inputs, layer_neurons, activation))
+            layers.append(Layer.random_layer(next_inputs, layer_neurons, activation, rng))
             next_inputs = layer_neurons
-        layers.append(Layer.random_layer(next_inputs, outputs, Sigmoid()))
+        layers.append(Layer.random_layer(next_inputs, outputs, Sigmoid(), rng))
         return cls(layers)
 
+    @classmethod
+    def from_genome(cls, layout: GenomeLayout, genome: np.ndarray):
+        network = cls.__new__(cls)
+        network.layout = layout
+        network.genome = genome
+        network.layers = layout.build(genome)
+        return network
+
+    def pack(self):
+        # Saves from before genomes have a (never used) weight matrix on the input layer; drop it
+        for layer in self.layers:
+            if isinstance(layer, InputLayer):
+                layer.weights = None
+                layer.biases = None
+
+        self.layout = GenomeLayout.of(self.layers)
+        self.genome = np.empty(self.layout.size)
+        views = iter(self.layout.segment_views(self.genome))
+        for layer in self.layers:
+            if layer.weights is None:
+                continue
+            layer.weights = copy_into(next(views), layer.weights)
+            layer.biases = copy_into(next(views), layer.biases)
+
     def add_layer(self, layer: Layer):
         self.layers.append(layer)
+        self.pack()
 
     def forward(self, inputs):
         for layer in self.layers:
@@ -81,19 +150,87 @@ class NeuralNetwork(object):
         return inputs
 
     def mutate(self, rate, scale):
-        for layer in self.layers:
-            layer.mutate(rate, scale)
+        gaussian(self.genome, rate, scale)
+        self.genome.clip(-1, 1, self.genome)
 
     def copy(self):
-        return NeuralNetwork(copy.deepcopy(self.layers))
+        return NeuralNetwork.from_genome(self.layout, self.genome.copy())
+
+    def astype(self, dtype):
+        # The same network with its genome in another precision, or this one if it already is
+        if self.genome.dtype == dtype:
+            return self
+        return NeuralNetwork.from_genome(self.layout, self.genome.astype(dtype))
 
     def crossover(self, father):
-        c1_layers = []
-        c2_layers = []
+        # Each weight and bias matrix picks its own crossover, as if they were bred one by one
+        c1_genome, c2_genome = segmented_crossover(self.genome, father.genome, 100, self.layout.segment_sizes)
+        return NeuralNetwork.from_genome(self.layout, c1_genome), NeuralNetwork.from_genome(self.layout, c2_genome)
+
+    def fingerprint(self):
+        return hashlib.blake2b(self.genome.tobytes(), digest_size=16).hexdigest()
+
+    def __getstate__(self):
+        return {'layout': self.layout, 'genome': self.genome}
 
-        for mother_layer, father_layer in zip(self.layers, father.layers):
-            c1_layer, c2_layer = mother_layer.crossover(father_layer)
-            c1_layers.append(c1_layer)
-            c2_layers.append(c2_layer)
+    def __setstate__(self, state):
+        self.layout = state['layout']
+        self.genome = state['genome']
+        self.layers = self.layout.build(self.genome)
 
-        return NeuralNetwork(c1_layers), NeuralNetwork(c2_layers)
+
+def copy_into(view: np.ndarray, values: np.ndarray):
+    view[...] = values
+    return view
+
+
+# Evaluates many networks of the same topology at once, one stacked matmul per layer
+class BatchedNetwork(object):
+    def __init__(self, networks: list):
+        self.setup(networks[0].layout, np.stack([network.genome for network in networks]), networks)
+
+    @classmethod
+    def from_genomes(cls, layout: GenomeLayout, genomes: np.ndarray, networks=None):
+        batch = cls.__new__(cls)
+        batch.setup(layout, genomes, networks if networks is not None else [None] * len(genomes))
+        return batch
+
+    def setup(self, layout: GenomeLayout, genomes: np.ndarray, networks: list):
+        self.layout = layout
+        self.genomes = genomes
+        self.networks = networks
+        self.activations = [activation for layer_class, inputs, neurons, activation in layout.layers
+                            if layer_class is not InputLayer]
+        views = layout.segment_views(genomes)
+        self.weights = views[0::2]
+        self.biases = views[1::2]
+        self.outputs = []
+
+    def __len__(self):
+        return len(self.networks)
+
+    def forward(self, inputs):
+        # inputs: one row of senses per network
+        inputs = np.asarray(inputs, dtype=self.genomes.dtype)[:, np.newaxis, :]
+        self.outputs = [inputs]
+        for weights, biases, activation in zip(self.weights, self.biases, self.activations):
+            inputs = activation.forward(np.matmul(inputs, weights) + biases)
+            self.outputs.append(inputs)
+        return inputs[:, 0, :]
+
+    def think(self, inputs):
+        return np.argmax(self.forward(inputs), axis=1)
+
+    def select(self, rows):
+        return BatchedNetwork.from_genomes(self.layout, self.genomes[rows], [self.networks[row] for row in rows])
+
+    def repeat(self, times: int):
+        # Every row `times` times over, next to each other
+        return self.select(np.repeat(np.arange(len(self)), times))
+
+    def expose(self, row: int):
+        # Copy a single row's layer states back onto its network, for the HUD
+        network = self.networks[row]
+        network.layers[0].output = [self.outputs[0][row][0]]
+        for layer, output in zip(network.layers[1:], self.outputs[1:]):
+            layer.output = output[row]
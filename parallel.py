@@ -0,0 +1,100 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from environment import SnakeEnvironment
+from neuralnetwork import BatchedNetwork
+from snake import Grid
+from vector import Vector
+
+# Shared memory blocks this worker process has attached to, by name. Workers only ever close them; the evaluator in
+# the parent creates and unlinks every block. Workers share the parent's resource tracker, so attaching registers
+# nothing new with it.
+attached = {}
+
+
+def attach(name: str):
+    if name not in attached:
+        attached[name] = shared_memory.SharedMemory(name=name)
+    return attached[name]
+
+
+def release(names):
+    for name in list(attached):
+        if name not in names:
+            attached.pop(name).close()
+
+
+# Worker side: play a slice of the population to completion and report back the results
+def play(task):
+    name, shape, dtype, layout, width, height, start, stop, seed, episodes, method, seeds = task
+    release([name])
+
+    genomes = np.ndarray(shape, dtype=dtype, buffer=attach(name).buf)[start:stop]
+    brains = BatchedNetwork.from_genomes(layout, genomes)
+    environment = SnakeEnvironment(Grid(Vector(width, height)), brains, seed, episodes=episodes, seeds=seeds)
+    environment.run()
+
+    return (start,) + environment.results(method)
+
+
+# Plays every snake of a generation across a pool of processes. Genomes are copied into shared memory
+# once per generation, so workers never unpickle networks.
+class ParallelEvaluator(object):
+    def __init__(self, workers: int):
+        self.workers = workers
+        # Started on the first evaluation, so a population that never evaluates never forks
+        self.pool = None
+        self.block = None
+        self.genomes = None
+
+    def allocate(self, count: int, size: int, dtype):
+        self.free()
+        self.block = shared_memory.SharedMemory(create=True, size=count * size * np.dtype(dtype).itemsize)
+        self.genomes = np.ndarray((count, size), dtype=dtype, buffer=self.block.buf)
+
+    def share(self, snakes: list):
+        size = snakes[0].brain.layout.size
+        dtype = snakes[0].brain.genome.dtype
+        if (self.genomes is None or len(snakes) > len(self.genomes) or size != self.genomes.shape[1] or
+                dtype != self.genomes.dtype):
+            self.allocate(len(snakes), size, dtype)
+
+        for row, snake in enumerate(snakes):
+            self.genomes[row] = snake.brain.genome
+
+    def evaluate(self, grid: Grid, snakes: list, rng=np.random, episodes=1, method='mean', seeds=None):
+        # seeds: optionally the episode seeds of every snake, one row each
+        self.share(snakes)
+        if self.pool is None:
+            # Only after the first block exists: that starts this process' resource tracker, which the workers then
+            # share instead of starting trackers of their own that would unlink the block when they exit
+            self.pool = multiprocessing.Pool(self.workers)
+
+        shards = np.array_split(np.arange(len(snakes)), self.workers * 2)
+        tasks = [(self.block.name, self.genomes.shape, self.genomes.dtype, snakes[0].brain.layout, grid.dimensions.x,
+                  grid.dimensions.y, int(shard[0]), int(shard[-1]) + 1, rng.randint(0, 2 ** 31), episodes, method,
+                  None if seeds is None else seeds[shard[0]:shard[-1] + 1])
+                 for shard in shards if len(shard)]
+
+        for start, fitness, length, age in self.pool.imap_unordered(play, tasks):
+            for i, snake in enumerate(snakes[start:start + len(fitness)]):
+                snake.fitness = fitness[i]
+                snake.length = length[i]
+                snake.age = age[i]
+                snake.alive = False
+
+    def free(self):
+        self.genomes = None
+        if self.block:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.free()
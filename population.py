@@ -1,16 +1,38 @@
+import heapq
 import time
-from copy import deepcopy
-from random import randint, random, choice
+from random import Random
 
+import numpy as np
+
+import memo
+from environment import SnakeEnvironment, aggregate_results
 from genetic.activation import ReLU
-from neuralnetwork import NeuralNetwork
+from genetic.crossover import segmented_crossover
+from genetic.mutation import gaussian
+from neuralnetwork import NeuralNetwork, BatchedNetwork, GenomeLayout
+from parallel import ParallelEvaluator
+from profiler import Profiler
+from replay import Trajectory
+from sensing import SENSES
 from snake import Snake, Grid
 from vector import Vector
 
+# Top snakes of a generation carried over into the next as they are. The all time best joins them on top.
+ELITES = 100
+
 
 class Population(object):
-    def __init__(self, snake_count: int, grid_size: Vector, cell_size: int):
+    def __init__(self, snake_count: int, grid_size: Vector, cell_size: int, vectorized=False, workers=0, seed=None,
+                 record=False, precision=np.float64, episodes=1, aggregation='mean', seeding='random', cache_size=4096):
         self.start_time = time.time()
+        # Every genome is kept, bred and evaluated in this dtype; float32 halves the weights' memory and bandwidth
+        self.precision = np.dtype(precision)
+        # Everything random in a run comes from these two, so a seed reproduces the whole run
+        self.random = Random(seed)
+        self.numpy_random = np.random.RandomState(seed)
+        # Record every game as a replay.Trajectory, keeping the best one
+        self.record = record
+        self.best_trajectory = None
         self.duration = 0
         self.best_length = 0
         self.best_current_length = 0
@@ -20,13 +42,40 @@ class Population(object):
         self.cell_size = cell_size
         self.generations = 1
         self.grid = Grid(grid_size, cell_size)
+        # Play every game in a single SnakeEnvironment instead of stepping Snake objects
+        self.vectorized = vectorized
+        self.environment = None
+        # Play whole generations across this many processes (0 plays them here, tick by tick)
+        self.evaluator = ParallelEvaluator(workers) if workers else None
+        # Every brain plays this many games a generation, its fitness aggregated over them by 'mean', 'min' or a
+        # quantile between 0 and 1. The games are played side by side, in the same batch.
+        self.episodes = episodes
+        self.aggregation = aggregation
+        # Episode seeds: 'random' every game, 'fixed' (the same for every brain, every generation) or 'genome' (the
+        # same for every brain with the same genome). With either of the last two a brain that comes round again
+        # would replay the same games, so its results are remembered in a memo.FitnessCache instead.
+        self.seeding = seeding
+        self.cache = memo.FitnessCache(cache_size) if seeding != 'random' else None
+        self.episode_seeds = None
+        if seeding == 'fixed':
+            self.episode_seeds = [self.random.getrandbits(32) for episode in range(0, episodes)]
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.inputs = SENSES
+        # Time spent per phase, reported in each generation's history entry
+        self.profiler = Profiler()
         relu = ReLU()
-        self.snakes = [Snake(self.grid, Vector(1 + randint(0, self.grid.dimensions.x - 2),
-                                               1 + randint(0, self.grid.dimensions.y - 2)),
-                             NeuralNetwork.create(28, [20, 20], 4, relu)) for x in range(0, snake_count)]
+        self.snakes = [self.spawn(NeuralNetwork.create(self.inputs, [20, 20], 4, relu, self.numpy_random))
+                       for x in range(0, snake_count)]
         self.active_snake = self.snakes[0]
         self.all_time_best_snake = self.active_snake
         self.history = []
+        # Optional archive.HallOfFame that records the top genomes of every generation
+        self.hall_of_fame = None
+        # Brains from other populations, waiting to join the next generation. See immigrate().
+        self.immigrants = []
+        self.lookup()
+        self.batch_brains()
 
         def noop():
             pass
@@ -34,10 +83,52 @@ class Population(object):
         self.on_generation = noop
 
     def move(self):
-        for snake in self.snakes:
-            if not snake.alive:
-                continue
-            snake.move()
+        if not self.playing:
+            # Every result came from the cache, so there's nothing to play
+            self.next_generation()
+            return
+
+        if self.evaluator:
+            self.move_generation()
+            return
+
+        if self.environment:
+            self.move_environment()
+            return
+
+        # Drop dead snakes from the batch once they make up most of it
+        live_rows = self.live_rows
+        if len(live_rows) * 2 < len(self.batch_snakes):
+            self.brains = self.brains.select(live_rows)
+            self.batch_snakes = [self.batch_snakes[row] for row in live_rows]
+            self.batch_rows = {snake: row for row, snake in enumerate(self.batch_snakes)}
+            self.index_live()
+            live_rows = self.live_rows
+
+        # Every snake's pre-move step first and its senses after, so each phase is timed on its own
+        profiler = self.profiler
+        started = profiler.now()
+        for row in live_rows:
+            snake = self.batch_snakes[row]
+            length = snake.length
+            snake.prepare_move()
+            if snake.length > length:
+                heapq.heappush(self.longest, (-snake.length, row))
+        started = profiler.add('movement', started, 0)
+
+        senses = np.zeros((len(self.batch_snakes), self.inputs))
+        for row in live_rows:
+            senses[row] = self.batch_snakes[row].senses()
+        started = profiler.add('sensing', started, len(live_rows))
+
+        decisions = self.brains.think(senses).tolist()
+        started = profiler.add('forward', started)
+
+        survivors = []
+        for row in live_rows:
+            snake = self.batch_snakes[row]
+            snake.steer(decisions[row])
+            snake.finish_move()
 
             if snake.length > self.best_length:
                 self.best_length = snake.length
@@ -46,18 +137,181 @@ class Population(object):
                 self.best_current_length = snake.length
                 self.active_snake = snake
 
-            if not self.active_snake.alive:
-                max_len = 0
-                for snake2 in self.snakes:
-                    if snake2.length > max_len and snake2.alive:
-                        max_len = snake2.length
-                        self.active_snake = snake2
+            if snake.alive:
+                survivors.append(row)
+        self.live_rows = survivors
+
+        if not self.active_snake.alive:
+            self.active_snake = self.longest_live()
 
-        if self.live_snakes() is 0:
+        if self.active_snake.alive and self.active_snake in self.batch_rows:
+            # Keep the HUD's view of the active brain up to date
+            self.brains.expose(self.batch_rows[self.active_snake])
+        profiler.add('movement', started, len(live_rows))
+
+        if not self.live_rows:
             # all sneks ded. :'(
+            self.score_episodes()
+            self.remember()
             self.next_generation()
 
+    def move_environment(self):
+        environment = self.environment
+        environment.step()
+
+        if environment.done():
+            # all sneks ded. :'(
+            self.best_length = max(self.best_length, int(environment.length.max()))
+            environment.sync(self.playing, self.aggregation)
+            self.remember()
+            self.next_generation()
+            return
+
+        leader = environment.leader()
+        length = int(environment.length[leader])
+        self.best_length = max(self.best_length, length)
+        self.best_current_length = max(self.best_current_length, length)
+        self.active_snake = self.playing[leader // environment.episodes]
+        self.active_snake.length = length
+
+    def move_generation(self):
+        started = self.profiler.now()
+        self.evaluator.evaluate(self.grid, self.playing, self.numpy_random, self.episodes, self.aggregation,
+                                self.playing_seeds)
+        self.profiler.add('evaluation', started, len(self.playing))
+        self.remember()
+        for snake in self.snakes:
+            self.best_length = max(self.best_length, snake.length)
+        self.next_generation()
+
+    def batch_brains(self):
+        if self.evaluator:
+            return
+        if not self.playing:
+            self.environment = None
+            self.episode_snakes = self.batch_snakes = []
+            self.live_rows = []
+            return
+        if self.vectorized:
+            self.environment = SnakeEnvironment(self.grid, [snake.brain for snake in self.playing],
+                                                self.numpy_random.randint(0, 2 ** 31), self.profiler, self.episodes,
+                                                self.playing_seeds)
+            return
+        if self.playing_seeds is None:
+            # Each snake plays its first episode itself, and copies sharing its brain play the rest
+            self.episode_snakes = [game for snake in self.playing for game in
+                                   [snake] + [self.spawn(snake.brain) for episode in range(1, self.episodes)]]
+        else:
+            self.episode_snakes = [self.spawn(snake.brain, int(seed))
+                                   for snake, seeds in zip(self.playing, self.playing_seeds) for seed in seeds]
+        self.batch_snakes = list(self.episode_snakes)
+        self.batch_rows = {snake: row for row, snake in enumerate(self.batch_snakes)}
+        self.brains = BatchedNetwork([snake.brain for snake in self.batch_snakes])
+        self.index_live()
+
+    def lookup(self):
+        # Work out which snakes have to play this generation: those without results in the cache, with the seeds
+        # of their episodes (None for random ones). The others get their remembered results straight away.
+        # Called once for every new set of snakes, before batch_brains().
+        self.playing = self.snakes
+        self.playing_seeds = None
+        if self.cache is None:
+            return
+
+        games = []
+        for snake in self.snakes:
+            fingerprint = snake.brain.fingerprint()
+            if self.seeding == 'fixed':
+                episode_seeds = self.episode_seeds
+            else:
+                episode_seeds = memo.genome_seeds(fingerprint, self.episodes)
+            games.append((snake, (fingerprint, tuple(episode_seeds)), episode_seeds))
+
+        playing = []
+        for snake, key, episode_seeds in games:
+            result = self.cache.get(key)
+            if result is None:
+                playing.append((snake, key, episode_seeds))
+            else:
+                snake.fitness, snake.length, snake.age = result
+                snake.alive = False
+        self.cache_hits = len(games) - len(playing)
+        self.cache_misses = len(playing)
+
+        self.playing = [snake for snake, key, episode_seeds in playing]
+        self.playing_keys = [key for snake, key, episode_seeds in playing]
+        self.playing_seeds = np.array([episode_seeds for snake, key, episode_seeds in playing], dtype=np.uint64)
+
+    def remember(self):
+        # Results of the games just played, for the next time the same genome plays the same seeds
+        if self.cache is None:
+            return
+        for snake, key in zip(self.playing, self.playing_keys):
+            self.cache.put(key, (snake.fitness, snake.length, snake.age))
+
+    def score_episodes(self):
+        # Hand each snake its results aggregated over the games it and its copies played
+        if self.episodes == 1 and self.playing_seeds is None:
+            return
+        games = self.episode_snakes
+        fitness, length, age = aggregate_results([game.fitness for game in games], [game.length for game in games],
+                                                 [game.age for game in games], self.episodes, self.aggregation)
+        for row, snake in enumerate(self.playing):
+            snake.fitness = fitness[row]
+            snake.length = length[row]
+            snake.age = age[row]
+            snake.alive = False
+            if self.playing_seeds is not None:
+                # The snake itself didn't play, the first of its games stands in for it in replays
+                snake.trajectory = games[row * self.episodes].trajectory
+
+    def index_live(self):
+        # Batch rows of the snakes still alive, and a heap of (-length, row) to find the longest of them. Lengths
+        # only grow, so an entry that no longer matches its (live) snake is just skipped.
+        self.live_rows = [row for row, snake in enumerate(self.batch_snakes) if snake.alive]
+        self.longest = [(-self.batch_snakes[row].length, row) for row in self.live_rows]
+        heapq.heapify(self.longest)
+
+    def longest_live(self):
+        longest = self.longest
+        while longest:
+            length, row = longest[0]
+            snake = self.batch_snakes[row]
+            if snake.alive and snake.length == -length:
+                return snake
+            heapq.heappop(longest)
+        return self.active_snake
+
+    def reseed(self, brains: list):
+        # Swap the given brains in for the first snakes of the current generation, which starts over
+        self.snakes = [self.spawn(brain) for brain in brains] + [self.spawn(snake.brain)
+                                                                 for snake in self.snakes[len(brains):]]
+        self.active_snake = self.snakes[0]
+        self.best_current_length = 0
+        self.lookup()
+        self.batch_brains()
+
+    def immigrate(self, brains: list):
+        # Brains from another population, to take the place of the newest children of the next generation bred
+        self.immigrants.extend(brains)
+
+    def spawn(self, brain: NeuralNetwork, seed=None):
+        if seed is None:
+            seed = self.random.getrandbits(32)
+        snake = Snake.seeded(self.grid, brain.astype(self.precision), seed)
+        if self.record:
+            snake.trajectory = Trajectory(snake.seed, self.grid.dimensions.x, self.grid.dimensions.y)
+        return snake
+
+    def games(self):
+        # Games played this generation
+        return len(self.playing) * self.episodes
+
     def live_snakes(self):
+        if self.environment:
+            return self.environment.live()
+        if not self.evaluator:
+            return len(self.live_rows)
         alive = 0
         for snake in self.snakes:
             if snake.alive:
@@ -65,18 +319,27 @@ class Population(object):
         return alive
 
     def next_generation(self):
+        started = self.profiler.now()
         snakes = self.snakes
         snakes.sort(key=lambda snake: snake.fitness, reverse=True)
 
+        if self.hall_of_fame is not None:
+            self.hall_of_fame.record(self.generations, snakes)
+
         best_snake = snakes[0]
         if best_snake.fitness > self.best_score:
             self.best_score = best_snake.fitness
-            self.all_time_best_snake = deepcopy(best_snake)
+            # Just its brain and results; the game it played isn't needed any more
+            self.all_time_best_snake = Snake.seeded(self.grid, best_snake.brain.copy(), best_snake.seed)
+            self.all_time_best_snake.fitness = best_snake.fitness
+            self.all_time_best_snake.length = best_snake.length
+            self.all_time_best_snake.age = best_snake.age
+            if best_snake.trajectory is not None:
+                self.best_trajectory = best_snake.trajectory
 
         # Keep top 500 snakes
         snakes = snakes[0:500]
 
-        # normalise fitness scores
         top_fitness = best_snake.fitness
         top_length = 0
         total_length = 0
@@ -85,7 +348,6 @@ class Population(object):
             total_length += snake.length
             top_length = max(snake.length, top_length)
             total_fitness += snake.fitness
-            snake.fitness /= top_fitness
 
         self.history.append(
             {
@@ -95,15 +357,16 @@ class Population(object):
                 "avg_length": int(total_length / len(snakes)),
                 "duration": int(time.time() - self.start_time)
             })
+        if self.cache is not None:
+            self.history[-1]["cache_hits"] = self.cache_hits
+            self.history[-1]["cache_misses"] = self.cache_misses
 
         # Reset timer
         self.start_time = time.time()
         self.best_current_length = 0
 
-        # Top 100 snakes from the last generation are always included in the next
-        self.snakes = [Snake(self.grid, Vector(1 + randint(0, self.grid.dimensions.x - 2),
-                                               1 + randint(0, self.grid.dimensions.y - 2)), snake.brain)
-                       for snake in snakes[0:100]]
+        # Top snakes from the last generation are always included in the next
+        self.snakes = [self.spawn(snake.brain) for snake in snakes[0:ELITES]]
 
         # Scale mutation based on how close we are getting to 100%
         mutation_scale = 0.5
@@ -111,44 +374,108 @@ class Population(object):
             mutation_scale = 0.1
 
         # Baby snakes!
-        for i in range(0, int((self.snake_count - len(self.snakes)) / 2)):
-            mother = self.select_parent(total_fitness, snakes)
-            father = self.select_parent(total_fitness, snakes)
-            brother_brain, sister_brain = mother.brain.crossover(father.brain)
-            brother_brain.mutate(0.02, mutation_scale)
-            sister_brain.mutate(0.02, mutation_scale)
-            self.snakes.append(Snake(self.grid, Vector(1 + randint(0, self.grid.dimensions.x - 2),
-                                                       1 + randint(0, self.grid.dimensions.y - 2)), brother_brain))
-            self.snakes.append(Snake(self.grid, Vector(1 + randint(0, self.grid.dimensions.x - 2),
-                                                       1 + randint(0, self.grid.dimensions.y - 2)), sister_brain))
-
-        self.snakes.append(Snake(self.grid, Vector(1 + randint(0, self.grid.dimensions.x - 2),
-                                                   1 + randint(0, self.grid.dimensions.y - 2)), self.all_time_best_snake.brain))
+        pairs = int((self.snake_count - len(self.snakes)) / 2)
+        brains = self.breed(snakes, pairs, mutation_scale)
+        # Immigrants take the place of the newest children; any there's no room for are dropped
+        immigrants = self.immigrants[0:len(brains)]
+        self.immigrants = []
+        for brain in brains[0:len(brains) - len(immigrants)] + immigrants:
+            self.snakes.append(self.spawn(brain))
+
+        self.snakes.append(self.spawn(self.all_time_best_snake.brain))
         self.generations += 1
         self.active_snake = self.snakes[0]
+        self.lookup()
+        self.batch_brains()
+        self.profiler.add('breeding', started)
+
+        # Whatever on_generation does (graphs, checkpoints) is charged to the next generation
+        self.history[-1]["profile"] = self.profiler.lap()
+        self.profiler.generation(self.generations)
         self.on_generation()
 
-    def select_parent(self, total_fitness, snakes):
+    def select_parents(self, snakes, count: int):
+        # Roulette wheel: every spin at once
+        wheel = np.cumsum([float(snake.fitness) for snake in snakes])
+        spins = self.numpy_random.random(count) * wheel[-1]
+        return np.minimum(np.searchsorted(wheel, spins, side='right'), len(snakes) - 1)
 
-        rand_fitness = random() * total_fitness
-        sum = 0
-        for snake in snakes:
-            sum += snake.fitness
-            if sum > rand_fitness:
-                return snake
-        return snakes[0]
-
-    def save_data(self):
-        return (
-            self.snakes, self.history, self.best_length, self.best_score, self.generations, self.all_time_best_snake,
-            self.active_snake, self.start_time)
-
-    def load_data(self, data):
-        self.snakes = data[0]
-        self.history = data[1]
-        self.best_length = data[2]
-        self.best_score = data[3]
-        self.generations = data[4]
-        self.all_time_best_snake = data[5]
-        self.active_snake = data[6]
-        self.start_time = data[7]
+    def breed(self, snakes, pairs: int, mutation_scale):
+        # Cross over and mutate every pair of parents in one pass over a matrix of genomes
+        layout = snakes[0].brain.layout
+        genomes = np.stack([snake.brain.genome for snake in snakes])
+        parents = self.select_parents(snakes, pairs * 2)
+        brothers, sisters = segmented_crossover(genomes[parents[:pairs]], genomes[parents[pairs:]], 100,
+                                                layout.segment_sizes, self.numpy_random)
+
+        children = np.empty((pairs * 2, layout.size), dtype=genomes.dtype)
+        children[0::2] = brothers
+        children[1::2] = sisters
+        gaussian(children, 0.02, mutation_scale, self.numpy_random)
+        children.clip(-1, 1, children)
+
+        # Every child's genome is a row of the one children matrix
+        return [NeuralNetwork.from_genome(layout, genome) for genome in children]
+
+    def close(self):
+        self.profiler.stop()
+        if self.evaluator:
+            self.evaluator.close()
+
+    def checkpoint_data(self):
+        # Genomes of this generation plus the all time best (last row), and everything else as plain metadata.
+        # Games in progress aren't saved; a loaded generation starts its games over.
+        # Nothing returned is shared with the population, so it can be written out while training carries on.
+        genomes = np.stack([snake.brain.genome for snake in self.snakes] + [self.all_time_best_snake.brain.genome])
+        numpy_state = self.numpy_random.get_state()
+        metadata = {
+            "layout": self.snakes[0].brain.layout.describe(),
+            "width": self.grid.dimensions.x,
+            "height": self.grid.dimensions.y,
+            "history": [dict(entry) for entry in self.history],
+            "best_length": self.best_length,
+            "best_score": self.best_score,
+            "best_snake_length": self.all_time_best_snake.length,
+            "generations": self.generations,
+            "start_time": self.start_time,
+            "episode_seeds": self.episode_seeds,
+            "random_state": self.random.getstate(),
+            "numpy_random_state": [numpy_state[0], numpy_state[1].tolist()] + list(numpy_state[2:])
+        }
+        return metadata, genomes
+
+    def load_checkpoint(self, metadata: dict, genomes: np.ndarray):
+        # Brains trained on another board or with another topology can't carry on here
+        layout = self.snakes[0].brain.layout.describe()
+        if metadata["layout"] != layout:
+            raise ValueError('Checkpoint networks are ' + str(metadata["layout"]) + ', not ' + str(layout))
+        size = [metadata.get("width", self.grid.dimensions.x), metadata.get("height", self.grid.dimensions.y)]
+        if size != [self.grid.dimensions.x, self.grid.dimensions.y]:
+            raise ValueError('Checkpoint is for a ' + str(size[0]) + 'x' + str(size[1]) + ' grid, not ' +
+                             str(self.grid.dimensions.x) + 'x' + str(self.grid.dimensions.y))
+
+        version, state, gauss = metadata["random_state"]
+        self.random.setstate((version, tuple(state), gauss))
+        name, keys, position, has_gauss, cached_gaussian = metadata["numpy_random_state"]
+        self.numpy_random.set_state((name, np.array(keys, dtype=np.uint32), position, has_gauss, cached_gaussian))
+
+        layout = GenomeLayout.from_description(metadata["layout"])
+        brains = [NeuralNetwork.from_genome(layout, genome) for genome in genomes]
+        self.snakes = [self.spawn(brain) for brain in brains[:-1]]
+        self.all_time_best_snake = self.spawn(brains[-1])
+        self.all_time_best_snake.fitness = metadata["best_score"]
+        self.all_time_best_snake.length = metadata["best_snake_length"]
+        self.history = metadata["history"]
+        self.best_length = metadata["best_length"]
+        self.best_score = metadata["best_score"]
+        self.generations = metadata["generations"]
+        self.start_time = metadata["start_time"]
+        # Fixed episode seeds carry on, as long as they're for as many episodes as this population plays. Otherwise
+        # (older checkpoints, other seeding or episodes) the ones drawn in __init__ stay.
+        seeds = metadata.get("episode_seeds")
+        if self.seeding == 'fixed' and seeds is not None and len(seeds) == self.episodes:
+            self.episode_seeds = seeds
+        self.best_current_length = 0
+        self.active_snake = self.snakes[0]
+        self.lookup()
+        self.batch_brains()
@@ -0,0 +1,64 @@
+import cProfile
+import time
+from collections import defaultdict
+
+# Phases in the order they're reported
+PHASES = ('sensing', 'forward', 'movement', 'evaluation', 'breeding', 'rendering', 'graphs', 'checkpointing')
+
+
+# Accumulates wall time and call counts per phase, reported and reset once a generation
+class Profiler(object):
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        # cProfile over a range of generations, see profile()
+        self.profile_first = None
+        self.profile_last = None
+        self.profile_path = None
+        self.profile = None
+
+    @staticmethod
+    def now():
+        return time.perf_counter()
+
+    def add(self, phase: str, started: float, calls: int = 1):
+        # Charge the time since started to phase, returning the current time to start the next phase from
+        now = time.perf_counter()
+        self.seconds[phase] += now - started
+        self.calls[phase] += calls
+        return now
+
+    def charge(self, phase: str, seconds: float, calls: int = 1):
+        # Time measured some other way, such as on another thread
+        self.seconds[phase] += seconds
+        self.calls[phase] += calls
+
+    def lap(self):
+        report = {}
+        for phase in sorted(self.seconds, key=lambda phase: PHASES.index(phase) if phase in PHASES else len(PHASES)):
+            report[phase] = {"seconds": round(self.seconds[phase], 4), "calls": self.calls[phase]}
+        self.seconds.clear()
+        self.calls.clear()
+        return report
+
+    def profile_generations(self, first: int, last: int, path: str):
+        # Run cProfile from the start of generation first to the end of generation last, writing pstats to path
+        self.profile_first = first
+        self.profile_last = last
+        self.profile_path = path
+
+    def generation(self, generation: int):
+        # Called as each generation starts
+        if self.profile_first is None:
+            return
+        if self.profile is None and self.profile_first <= generation <= self.profile_last:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.profile is not None and generation > self.profile_last:
+            self.stop()
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.profile_path)
+            self.profile = None
@@ -0,0 +1,68 @@
+import numpy as np
+
+from neuralnetwork import InputLayer, NeuralNetwork, BatchedNetwork
+from replay import Trajectory
+from snake import Grid, Snake
+from vector import Vector
+
+
+def quantize(values: np.ndarray, axis: int):
+    # Symmetric int8 with one scale per slice along axis
+    scale = np.abs(values).max(axis=axis, keepdims=True) / 127
+    scale[scale == 0] = 1
+    return np.round(values / scale).astype(np.int8), scale.astype(np.float32)
+
+
+# Int8 inference for a trained network: int8 weights with a scale per output neuron, and inputs quantized per row on
+# the way into every layer. Products are summed in int32 and scaled back to float for the bias and activation.
+class QuantizedNetwork(object):
+    def __init__(self, network: NeuralNetwork):
+        self.layout = network.layout
+        self.layers = []
+        for layer in network.layers:
+            if isinstance(layer, InputLayer):
+                continue
+            weights, scale = quantize(layer.weights, 0)
+            self.layers.append((weights, scale, layer.biases.astype(np.float32), layer.activation))
+
+    def nbytes(self):
+        return sum(weights.nbytes + scale.nbytes + biases.nbytes for weights, scale, biases, activation in self.layers)
+
+    def forward(self, inputs):
+        # inputs: one row of senses per decision
+        inputs = np.atleast_2d(np.asarray(inputs, dtype=np.float32))
+        for weights, scale, biases, activation in self.layers:
+            quantized, input_scale = quantize(inputs, 1)
+            total = np.matmul(quantized.astype(np.int32), weights.astype(np.int32))
+            inputs = activation.forward(total * (input_scale * scale) + biases)
+        return inputs
+
+    def think(self, inputs):
+        return np.argmax(self.forward(inputs), axis=1)
+
+
+def agreement(trajectory: Trajectory, policy):
+    # Replays a recorded game, counting the steps where policy (anything with think(rows of senses)) picks the move
+    # that was recorded
+    snake = Snake.seeded(Grid(Vector(trajectory.width, trajectory.height)), None, trajectory.seed)
+    matches = 0
+    steps = 0
+    for step in range(0, trajectory.steps):
+        if not snake.alive:
+            break
+        snake.prepare_move()
+        action = trajectory.action(step)
+        if int(policy.think(np.array([snake.senses()]))[0]) == action:
+            matches += 1
+        steps += 1
+        snake.steer(action)
+        snake.finish_move()
+    return matches, steps
+
+
+def check(trajectory: Trajectory, brain: NeuralNetwork):
+    # How often the float network and its int8 version each repeat a game the float network played
+    return {
+        "float": agreement(trajectory, BatchedNetwork([brain])),
+        "int8": agreement(trajectory, QuantizedNetwork(brain))
+    }
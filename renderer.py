@@ -1,27 +1,86 @@
+import numpy as np
 import pygame
 
+from environment import BODY
 from neuralnetwork import NeuralNetwork
 from population import Population
 from snake import Snake, Grid
 from vector import Vector
 
 
+# What one displayed frame shows of a population, copied out while the simulation is held so that drawing it
+# doesn't keep training waiting
+class Frame(object):
+    def __init__(self, population: Population, board: bool = True):
+        self.grid = population.grid
+        self.live_snakes = population.live_snakes()
+        self.games = population.games()
+        self.best_score = population.best_score
+        self.best_length = population.best_length
+        self.generations = population.generations
+        self.length = population.active_snake.length
+        self.profile = population.history[-1].get("profile") if population.history else None
+        # The active brain's weights never change once it plays, so it's kept by reference; its states do change
+        self.brain = population.active_snake.brain
+        self.states = [[layer.get_neuron_state(neuron) for neuron in range(0, layer.neurons)]
+                       for layer in self.brain.layers]
+        # Board: snakes per cell for everyone but the focused snake, indexed [x, y], plus the focused snake's cells
+        # and food
+        self.heat = None
+        self.cells = []
+        self.food = None
+        if board:
+            self.capture_board(population)
+
+    def capture_board(self, population: Population):
+        grid = population.grid
+        if population.environment:
+            environment = population.environment
+            leader = environment.leader()
+            alive = environment.alive.copy()
+            alive[leader] = False
+            self.heat = (environment.occupancy[alive] & BODY).sum(axis=0, dtype=np.int32).T
+            if environment.alive[leader]:
+                self.cells = list(environment.segments(leader))
+                self.food = (int(environment.food_x[leader]), int(environment.food_y[leader]))
+            return
+
+        width = grid.dimensions.x
+        active_snake = population.active_snake
+        cells = [cell for snake in population.episode_snakes
+                 if snake.alive and snake is not active_snake for cell in snake.tail]
+        heat = np.bincount(cells, minlength=width * grid.dimensions.y)
+        self.heat = heat.reshape(grid.dimensions.y, width).T
+        if active_snake.alive:
+            self.cells = [(cell % width, cell // width) for cell in active_snake.tail]
+            food = active_snake.food.position
+            self.food = (food.x, food.y)
+
+
 class Renderer(object):
-    def __init__(self, game: pygame, display, population: Population, cell_size: int, position: Vector):
+    def __init__(self, game: pygame, display, cell_size: int, position: Vector):
         self.game = game
         self.display = display
         self.cell_size = cell_size
         self.position = position
-        self.population = population
-
-    def draw(self):
-        self.draw_grid(self.population.grid)
-
-        for snake in self.population.snakes:
-            if snake is not self.population.active_snake:
-                self.draw_snake(snake, False)
-
-        self.draw_snake(self.population.active_snake, True)
+        # Surfaces for the population heat map, rebuilt when the grid changes
+        self.heat_dimensions = None
+        self.cell_surface = None
+        self.heat_surface = None
+        self.gap_surface = None
+
+    def draw(self, frame: Frame):
+        self.draw_border(frame.grid)
+        self.draw_heat(frame.grid, frame.heat)
+        for x, y in frame.cells:
+            pygame.draw.rect(self.display, (0, 255, 255), self.cell_to_rect(x, y))
+        if frame.food:
+            pygame.draw.rect(self.display, (255, 0, 255), self.cell_to_rect(*frame.food))
+
+    def draw_replay(self, replay):
+        # A recorded game instead of the live population
+        self.draw_grid(replay.grid)
+        self.draw_snake(replay.snake, True)
 
     def draw_snake(self, snake: Snake, focus: bool):
         snake_colour = (0, 255, 255)
@@ -31,23 +90,69 @@ class Renderer(object):
             food_colour = (120, 0, 120)
         if not snake.alive:
             return
-        for segment in snake.tail:
-            pygame.draw.rect(self.display, snake_colour, self.cell_to_rect(segment))
+        width = snake.grid.dimensions.x
+        for cell in snake.tail:
+            pygame.draw.rect(self.display, snake_colour, self.cell_to_rect(cell % width, cell // width))
         # Food
         if focus:
-            pygame.draw.rect(self.display, food_colour, self.cell_to_rect(snake.food.position))
-
-    def draw_grid(self, grid: Grid):
+            food = snake.food.position
+            pygame.draw.rect(self.display, food_colour, self.cell_to_rect(food.x, food.y))
+
+    def draw_heat(self, grid: Grid, heat: np.ndarray):
+        # heat: snakes per cell, indexed [x, y]. One pixel per cell, scaled up with the gaps laid over the top.
+        if self.heat_dimensions != (grid.dimensions.x, grid.dimensions.y):
+            self.layout_heat(grid)
+
+        colours = np.empty(heat.shape + (3,), dtype=np.uint8)
+        colours[:] = (80, 80, 80)
+        covered = heat > 0
+        if covered.any():
+            # Log scale, so a lone snake still shows up next to a crowd
+            shade = 60 + 195 * np.log1p(heat[covered]) / np.log1p(heat.max())
+            colours[covered, 0] = 0
+            colours[covered, 1] = shade
+            colours[covered, 2] = shade
+
+        pygame.surfarray.blit_array(self.cell_surface, colours)
+        pygame.transform.scale(self.cell_surface, self.heat_surface.get_size(), self.heat_surface)
+        self.heat_surface.blit(self.gap_surface, (0, 0))
+        self.display.blit(self.heat_surface, (self.position.x, self.position.y))
+
+    def layout_heat(self, grid: Grid):
+        pitch = self.cell_size + 2
+        size = (pitch * grid.dimensions.x, pitch * grid.dimensions.y)
+        self.cell_surface = pygame.Surface((grid.dimensions.x, grid.dimensions.y), depth=24)
+        self.heat_surface = pygame.Surface(size, depth=24)
+
+        # Grey between cells, see-through (black colour key) inside them
+        columns = np.arange(size[0]) % pitch
+        rows = np.arange(size[1]) % pitch
+        column_gaps = (columns == 0) | (columns > self.cell_size)
+        row_gaps = (rows == 0) | (rows > self.cell_size)
+        gaps = column_gaps[:, None] | row_gaps[None, :]
+        pixels = np.zeros(size + (3,), dtype=np.uint8)
+        pixels[gaps] = (80, 80, 80)
+        self.gap_surface = pygame.Surface(size, depth=24)
+        pygame.surfarray.blit_array(self.gap_surface, pixels)
+        self.gap_surface.set_colorkey((0, 0, 0))
+        self.heat_dimensions = (grid.dimensions.x, grid.dimensions.y)
+
+    def draw_border(self, grid: Grid):
         total_width = (self.cell_size + 2) * grid.dimensions.x
         total_height = (self.cell_size + 2) * grid.dimensions.y
         pygame.draw.rect(self.display, (255, 0, 255),
                          [self.position.x - 2, self.position.y - 2, total_width + 4, total_height + 4])
+
+    def draw_grid(self, grid: Grid):
+        total_width = (self.cell_size + 2) * grid.dimensions.x
+        total_height = (self.cell_size + 2) * grid.dimensions.y
+        self.draw_border(grid)
         pygame.draw.rect(self.display, (80, 80, 80), [self.position.x, self.position.y, total_width, total_height])
 
-    def cell_to_rect(self, position: Vector):
+    def cell_to_rect(self, x: int, y: int):
         return [
-            self.position.x + (position.x * (self.cell_size + 2)) + 1,
-            self.position.y + (position.y * (self.cell_size + 2)) + 1,
+            self.position.x + (x * (self.cell_size + 2)) + 1,
+            self.position.y + (y * (self.cell_size + 2)) + 1,
             self.cell_size,
             self.cell_size
         ]
@@ -80,32 +185,59 @@ class NetworkDisplay(object):
 
             self.neuron_positions.append(neuron_position_layer)
 
-    def draw(self, game: pygame, display):
-
-        # Draw weights
-        for i, layer in enumerate(self.neuron_positions):
-            for neuron_index, neuron in enumerate(layer):
-                if i is not 0:
-                    for weight_offset, weight in enumerate(self.network.layers[i].weights.T[neuron_index]):
-                        previous_layer = self.neuron_positions[i - 1]
-                        previous_neuron = previous_layer[weight_offset]
-                        line_strength = int(weight * 10)
-
-                        if line_strength < 0:
-                            colour = (100, min(255, -line_strength + 50), min(255, -line_strength + 50))
-                        else:
-                            colour = (min(255, line_strength + 50), min(255, line_strength + 50), 100)
-                        pygame.draw.line(display, colour, [neuron.x, neuron.y],
-                                         [previous_neuron.x, previous_neuron.y], 1)
+        # Weight lines and neuron outlines of the network last drawn, see-through where black. Outlines can poke
+        # out of the display's bounds, hence the margin.
+        self.margin = self.neuron_size + 2
+        self.weights_surface = pygame.Surface((self.dimensions.x + self.margin * 2,
+                                               self.dimensions.y + self.margin * 2))
+        self.weights_surface.set_colorkey((0, 0, 0))
+        self.drawn_network = None
+
+    def draw(self, game: pygame, display, states: list):
+        # states: every layer's neuron states, as Frame.states.
+        # Weights only change with the network, so they're drawn once per network and blitted after that
+        if self.drawn_network is not self.network:
+            self.draw_weights()
+            self.drawn_network = self.network
+        display.blit(self.weights_surface, (self.position.x - self.margin, self.position.y - self.margin))
 
         # Draw neurons
         for layer_index, layer in enumerate(self.neuron_positions):
             for neuron_index, neuron in enumerate(layer):
-                pygame.draw.circle(display, (255, 255, 255), [neuron.x, neuron.y], self.neuron_size + 1)
-                state = self.network.layers[layer_index].get_neuron_state(neuron_index)
+                state = states[layer_index][neuron_index]
                 if state > 0:
                     brightness = min(255, int(state * 255))
                     pygame.draw.circle(display, (brightness, brightness, brightness), [neuron.x, neuron.y],
                                        self.neuron_size)
                 else:
                     pygame.draw.circle(display, (40, 40, 40), [neuron.x, neuron.y], self.neuron_size)
+
+    def draw_weights(self):
+        surface = self.weights_surface
+        surface.fill((0, 0, 0))
+        offset_x = self.position.x - self.margin
+        offset_y = self.position.y - self.margin
+
+        for i, layer in enumerate(self.neuron_positions):
+            if i == 0:
+                continue
+            previous_layer = self.neuron_positions[i - 1]
+            # Colours for every weight of the layer at once, [neuron, previous neuron]
+            strength = (self.network.layers[i].weights.T * 10).astype(int)
+            shade = np.minimum(255, np.abs(strength) + 50).tolist()
+            negative = (strength < 0).tolist()
+            for neuron_index, neuron in enumerate(layer):
+                for weight_offset, previous_neuron in enumerate(previous_layer):
+                    line_shade = shade[neuron_index][weight_offset]
+                    if negative[neuron_index][weight_offset]:
+                        colour = (100, line_shade, line_shade)
+                    else:
+                        colour = (line_shade, line_shade, 100)
+                    pygame.draw.line(surface, colour, [neuron.x - offset_x, neuron.y - offset_y],
+                                     [previous_neuron.x - offset_x, previous_neuron.y - offset_y], 1)
+
+        # Neuron outlines, filled in with their state every frame
+        for layer in self.neuron_positions:
+            for neuron in layer:
+                pygame.draw.circle(surface, (255, 255, 255), [neuron.x - offset_x, neuron.y - offset_y],
+                                   self.neuron_size + 1)
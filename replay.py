@@ -0,0 +1,95 @@
+import copy
+import struct
+
+from snake import Grid, Snake
+from vector import Vector
+
+# seed, grid width, grid height, steps
+TRAJECTORY_HEADER = struct.Struct('<QHHI')
+
+
+# A whole game as its seed plus one 2 bit steer (up, down, left, right) per step
+class Trajectory(object):
+    def __init__(self, seed: int, width: int, height: int, actions: bytearray = None, steps: int = 0):
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.actions = actions if actions is not None else bytearray()
+        self.steps = steps
+
+    def append(self, direction, velocity: Vector):
+        if direction is None:
+            # The brain had no idea; keeping the current heading does the same thing
+            direction = heading(velocity)
+        if self.steps % 4 == 0:
+            self.actions.append(0)
+        self.actions[-1] |= int(direction) << (self.steps % 4) * 2
+        self.steps += 1
+
+    def action(self, step: int):
+        return (self.actions[step // 4] >> (step % 4) * 2) & 3
+
+    def to_bytes(self):
+        return TRAJECTORY_HEADER.pack(self.seed, self.width, self.height, self.steps) + bytes(self.actions)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        seed, width, height, steps = TRAJECTORY_HEADER.unpack_from(data)
+        return cls(seed, width, height, bytearray(data[TRAJECTORY_HEADER.size:]), steps)
+
+
+def heading(velocity: Vector):
+    if velocity.y < 0:
+        return 0
+    if velocity.y > 0:
+        return 1
+    if velocity.x < 0:
+        return 2
+    return 3
+
+
+# Plays a trajectory back on a brainless snake. Snapshots taken every keyframe_interval steps make seeking cheap.
+class Replay(object):
+    def __init__(self, trajectory: Trajectory, keyframe_interval: int = 100):
+        self.trajectory = trajectory
+        self.grid = Grid(Vector(trajectory.width, trajectory.height))
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = {}
+        self.snake = None
+        self.step_index = 0
+        self.restart()
+
+    def restart(self):
+        self.snake = Snake.seeded(self.grid, None, self.trajectory.seed)
+        self.step_index = 0
+
+    def done(self):
+        return self.step_index >= self.trajectory.steps or not self.snake.alive
+
+    def step(self):
+        if self.done():
+            return False
+        if self.step_index % self.keyframe_interval == 0 and self.step_index not in self.keyframes:
+            self.keyframes[self.step_index] = copy.deepcopy(self.snake)
+
+        self.snake.prepare_move()
+        self.snake.steer(self.trajectory.action(self.step_index))
+        self.snake.finish_move()
+        self.step_index += 1
+        return True
+
+    def seek(self, step: int):
+        step = max(0, min(step, self.trajectory.steps))
+        # Start from the last keyframe before the step, unless we're already closer
+        keyframes = [keyframe for keyframe in self.keyframes if keyframe <= step]
+        keyframe = max(keyframes) if keyframes else None
+        if step < self.step_index or (keyframe is not None and keyframe > self.step_index):
+            if keyframe is None:
+                self.restart()
+            else:
+                self.step_index = keyframe
+                self.snake = copy.deepcopy(self.keyframes[keyframe])
+
+        while self.step_index < step and self.step():
+            pass
+        return self.snake
@@ -1,19 +1,124 @@
+import json
 import os
-import pickle
+import struct
+import threading
 
+import numpy as np
 
-class SaveState(object):
+
+# Checkpoint file: header (magic, format version, metadata length), JSON metadata, then the genome matrix as raw
+# float64 rows, aligned so it can be memory-mapped straight back in.
+CHECKPOINT_MAGIC = b'SNAKECKP'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_HEADER = struct.Struct('<8sII')
+CHECKPOINT_ALIGNMENT = 64
+
+
+def genome_offset(metadata_length: int):
+    end = CHECKPOINT_HEADER.size + metadata_length
+    return -(-end // CHECKPOINT_ALIGNMENT) * CHECKPOINT_ALIGNMENT
+
+
+class Checkpoint(object):
     def __init__(self, path):
         self.path = path
 
-    def save(self, data):
-        with open(self.path, 'wb') as handle:
-            pickle.dump(data, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    def save(self, metadata: dict, genomes: np.ndarray):
+        genomes = np.ascontiguousarray(genomes, dtype=np.float64)
+        metadata = dict(metadata, rows=genomes.shape[0], genes=genomes.shape[1])
+        encoded = json.dumps(metadata).encode('utf-8')
+        offset = genome_offset(len(encoded))
+
+        # Written in full next to the checkpoint and then renamed over it, so the path always holds a whole
+        # checkpoint (and anything that has the old one mapped keeps its copy)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as handle:
+            handle.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, len(encoded)))
+            handle.write(encoded)
+            handle.write(b'\0' * (offset - CHECKPOINT_HEADER.size - len(encoded)))
+            genomes.tofile(handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, self.path)
 
     def open(self):
         with open(self.path, 'rb') as handle:
-            b = pickle.load(handle)
-        return b
+            magic, version, length = CHECKPOINT_HEADER.unpack(handle.read(CHECKPOINT_HEADER.size))
+            if magic != CHECKPOINT_MAGIC:
+                raise ValueError(self.path + ' is not a checkpoint')
+            if version > CHECKPOINT_VERSION:
+                raise ValueError(self.path + ' is checkpoint version ' + str(version) + ', newer than this code')
+            metadata = json.loads(handle.read(length).decode('utf-8'))
+
+        # Copy on write: pages load lazily, and nothing we change goes back to the file
+        genomes = np.memmap(self.path, dtype=np.float64, mode='c', offset=genome_offset(length),
+                            shape=(metadata['rows'], metadata['genes']))
+        return metadata, genomes
 
     def delete(self):
         os.unlink(self.path)
+
+
+# Writes checkpoints on a background thread. Only the newest pending save per path is kept, and once a save is
+# written the files this writer made beyond the newest `keep` are deleted (0 keeps them all).
+class CheckpointWriter(object):
+    def __init__(self, keep: int = 0):
+        self.keep = keep
+        self.written = []
+        self.pending = {}
+        self.busy = False
+        self.running = True
+        self.changed = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, path: str, metadata: dict, genomes: np.ndarray):
+        # metadata and genomes must not change after this; Population.checkpoint_data() hands out copies
+        with self.changed:
+            self.pending.pop(path, None)
+            self.pending[path] = (metadata, genomes)
+            self.changed.notify_all()
+
+    def run(self):
+        while True:
+            with self.changed:
+                while self.running and not self.pending:
+                    self.changed.wait()
+                if not self.pending:
+                    return
+                path = next(iter(self.pending))
+                metadata, genomes = self.pending.pop(path)
+                self.busy = True
+
+            # One bad save mustn't stop the ones after it, or leave flush() waiting for good
+            try:
+                Checkpoint(path).save(metadata, genomes)
+                self.retain(path)
+            except Exception as error:
+                print("Checkpoint " + path + " failed: " + repr(error), flush=True)
+            finally:
+                with self.changed:
+                    self.busy = False
+                    self.changed.notify_all()
+
+    def retain(self, path: str):
+        if path in self.written:
+            self.written.remove(path)
+        self.written.append(path)
+        while self.keep and len(self.written) > self.keep:
+            try:
+                os.unlink(self.written.pop(0))
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        # Wait for every pending save to be written
+        with self.changed:
+            while self.pending or self.busy:
+                self.changed.wait()
+
+    def close(self):
+        with self.changed:
+            self.running = False
+            self.changed.notify_all()
+        self.thread.join()
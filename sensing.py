@@ -0,0 +1,53 @@
+# Scan in 8 directions, in the order the brain expects them
+DIRECTIONS = [(-1, 0), (-1, -1), (1, 0), (1, -1), (0, -1), (1, 1), (0, 1), (-1, 1)]
+DIRECTION_INDEX = {direction: i for i, direction in enumerate(DIRECTIONS)}
+NEIGHBOURS = tuple(enumerate(DIRECTIONS))
+
+SENSES = 28
+
+
+def sign(value: int):
+    return (value > 0) - (value < 0)
+
+
+# Fills senses in for a head at x, y. occupied holds the y * width + x cells of the body. Nothing here walks
+# further than the snake is long, so the cost doesn't depend on the size of the grid.
+def sense(width: int, height: int, x: int, y: int, food_x: int, food_y: int, velocity_x: int, velocity_y: int,
+          occupied, length: int, senses: list):
+    food_cell = food_y * width + food_x
+
+    # Walls and body only matter right next to the head
+    for i, (direction_x, direction_y) in NEIGHBOURS:
+        ray_x = x + direction_x
+        ray_y = y + direction_y
+        senses[i] = 1
+        if 0 <= ray_x < width and 0 <= ray_y < height:
+            neighbour = ray_y * width + ray_x
+            senses[8 + i] = 0
+            senses[16 + i] = int(neighbour != food_cell and neighbour in occupied)
+        else:
+            senses[8 + i] = 1
+            senses[16 + i] = 0
+
+    # Food can only sit on one ray, and is hidden if the body is in the way. The body is a path from the head,
+    # so none of it is more than length - 1 steps away: past that the ray is clear.
+    dx = food_x - x
+    dy = food_y - y
+    distance = max(abs(dx), abs(dy))
+    if distance > 0 and (dx == 0 or dy == 0 or abs(dx) == abs(dy)):
+        step_x = sign(dx)
+        step_y = sign(dy)
+        stride = step_y * width + step_x
+        ray = y * width + x
+        for step in range(1, min(distance, length)):
+            ray += stride
+            if ray in occupied:
+                break
+        else:
+            senses[DIRECTION_INDEX[(step_x, step_y)]] = 1 / distance
+
+    senses[24] = int(-velocity_y > 0)
+    senses[25] = int(velocity_y > 0)
+    senses[26] = int(-velocity_x > 0)
+    senses[27] = int(velocity_x > 0)
+    return senses
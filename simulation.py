@@ -0,0 +1,56 @@
+import threading
+import time
+
+from population import Population
+
+
+# Steps a population on its own thread, so training isn't held back by drawing it.
+# Viewers hold the lock while they look at the population, which gives them a consistent view between ticks.
+class Simulation(object):
+    def __init__(self, population: Population, ticks_per_frame: int = 0):
+        self.population = population
+        # Ticks allowed per displayed frame; 0 runs as fast as possible
+        self.ticks_per_frame = ticks_per_frame
+        self.paused = False
+        self.running = True
+        self.budget = 0
+        self.ticks = 0
+        self.lock = threading.RLock()
+        self.wake = threading.Condition(self.lock)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.wake:
+                while self.running and (self.paused or (self.ticks_per_frame and self.budget <= 0)):
+                    self.wake.wait()
+                if not self.running:
+                    return
+                self.population.move()
+                self.ticks += 1
+                self.budget -= 1
+            # Give the viewer a chance at the lock between ticks
+            time.sleep(0)
+
+    def frame(self):
+        # Called once per displayed frame: allow the next ticks_per_frame ticks
+        with self.wake:
+            self.budget = self.ticks_per_frame
+            self.wake.notify()
+
+    def set_ticks_per_frame(self, ticks_per_frame: int):
+        with self.wake:
+            self.ticks_per_frame = max(0, ticks_per_frame)
+            self.wake.notify()
+
+    def toggle_pause(self):
+        with self.wake:
+            self.paused = not self.paused
+            self.wake.notify()
+
+    def stop(self):
+        with self.wake:
+            self.running = False
+            self.wake.notify()
+        self.thread.join()
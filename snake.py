@@ -1,11 +1,19 @@
 import time
-
-from random import randint, random
+from collections import deque
+from random import Random
 
 from neuralnetwork import NeuralNetwork
+from sensing import SENSES, sense
 from vector import Vector
 
 
+# Velocities; snakes only ever point at one of these, so steering allocates nothing
+UP = Vector(0, -1)
+DOWN = Vector(0, 1)
+LEFT = Vector(-1, 0)
+RIGHT = Vector(1, 0)
+
+
 # The grid a single snake lives on
 class Grid(object):
     def __init__(self, dimensions: Vector, cell_size=10):
@@ -13,13 +21,33 @@ class Grid(object):
         self.cell_size = cell_size
 
 
+def calculate_fitness(length: int, age: int, explored: int, cells: int):
+    score = length - 1
+    # Fitness is primarily the score we achieved (how many apples) + how long we managed to stay alive
+    fitness = min(age, (2 ** score)) + (2 ** score)
+    # How many cells did we explore
+    fitness += explored ** 2
+
+    if length == cells:
+        # Big bonus for winning
+        fitness += score ** 2
+
+    return fitness
+
+
 class Snake(object):
-    def __init__(self, grid: Grid, position: Vector, brain: NeuralNetwork, length=1):
+    def __init__(self, grid: Grid, position: Vector, brain: NeuralNetwork, length=1, random: Random = None):
+        # Every random thing in this snake's game (its food) comes from here, so a seed replays the same game
+        self.random = random if random is not None else Random()
+        self.seed = None
         self.length = max(1, length)
         self.grid = grid
         self.position = position
-        self.velocity = Vector(0, 1)
-        self.tail = []
+        self.velocity = DOWN
+        # Cells are packed as y * width + x. The tail's cells, oldest first, and the same cells as a set, so memory
+        # goes with the snake's length rather than the grid.
+        self.tail = deque()
+        self.occupied = set()
         self.alive = True
         self.brain = brain
         self.age = 0
@@ -28,7 +56,20 @@ class Snake(object):
         self.fitness = 0
         self.food = Food(self.grid, self)
         self.total_food_distance = 0
+        # Every cell the snake has moved into, at most once each
         self.visited = set()
+        self.vision = [0] * SENSES
+        # Optional replay.Trajectory that every steer is written to
+        self.trajectory = None
+
+    @classmethod
+    def seeded(cls, grid: Grid, brain: NeuralNetwork, seed: int):
+        # The start position comes from the seed too
+        random = Random(seed)
+        position = Vector(1 + random.randint(0, grid.dimensions.x - 2), 1 + random.randint(0, grid.dimensions.y - 2))
+        snake = cls(grid, position, brain, random=random)
+        snake.seed = seed
+        return snake
 
     def think(self):
         ideas = self.brain.forward(self.senses())[0]
@@ -39,20 +80,26 @@ class Snake(object):
                 strongest_idea = idea
                 strongest_index = i
 
-        if strongest_index is 0:
+        self.steer(strongest_index)
+
+    def steer(self, direction):
+        if self.trajectory is not None:
+            self.trajectory.append(direction, self.velocity)
+        if direction == 0:
             self.up()
-        elif strongest_index is 1:
+        elif direction == 1:
             self.down()
-        elif strongest_index is 2:
+        elif direction == 2:
             self.left()
-        elif strongest_index is 3:
+        elif direction == 3:
             self.right()
 
     def eat(self):
         self.grow()
         self.hunger = (self.grid.dimensions.x * self.grid.dimensions.y)
         #self.hunger = min(self.hunger, 500)
-        last_food = self.food.position.copy()
+        # Food.move always puts a new vector in place, so this one stays put
+        last_food = self.food.position
         self.food.move()
         if self.length > 2:
             # we have travelled far, between foods. Keep track for fitness!
@@ -61,23 +108,37 @@ class Snake(object):
     def move(self):
         if not self.alive:
             return
+        self.prepare_move()
+        if not self.alive:
+            return
+        self.think()
+        self.finish_move()
+
+    # Everything that happens before the brain decides where to go
+    def prepare_move(self):
         self.age += 1
         self.hunger -= 1
 
         if self.length == self.grid.dimensions.x * self.grid.dimensions.y:
-            # Win!
+            # Win! The game ends here, as it does in SnakeEnvironment.
             self.die()
+            return
 
-        if self.position.equals(self.food.position):
+        if self.position == self.food.position:
             # Nom.
             self.eat()
 
-        self.think()
-
-        new_position = self.position.add(self.velocity)
+    # Step in the chosen direction
+    def finish_move(self):
+        if not self.alive:
+            return
+        x = self.position.x + self.velocity.x
+        y = self.position.y + self.velocity.y
+        width = self.grid.dimensions.x
+        cell = y * width + x
 
         # Collision
-        if self.is_collision(new_position):
+        if x < 0 or y < 0 or x >= width or y >= self.grid.dimensions.y or cell in self.occupied:
             self.die()
             return
         # Died of hunger...
@@ -85,11 +146,14 @@ class Snake(object):
             self.die()
             return
 
-        self.position = new_position
-        while len(self.tail) >= self.length:
-            self.tail.pop(0)
-        self.tail.append(new_position)
-        self.visited.add(self.position)
+        self.position = Vector(x, y)
+        occupied = self.occupied
+        tail = self.tail
+        while len(tail) >= self.length:
+            occupied.discard(tail.popleft())
+        tail.append(cell)
+        occupied.add(cell)
+        self.visited.add(cell)
 
     def grow(self):
         self.length += 1
@@ -99,99 +163,41 @@ class Snake(object):
         self.alive = False
 
     def up(self):
-        if self.velocity.y is 1:
+        if self.velocity.y == 1:
             return
-        self.velocity = Vector(0, -1)
+        self.velocity = UP
 
     def down(self):
-        if self.velocity.y is -1:
+        if self.velocity.y == -1:
             return
-        self.velocity = Vector(0, 1)
+        self.velocity = DOWN
 
     def left(self):
-        if self.velocity.x is 1:
+        if self.velocity.x == 1:
             return
-        self.velocity = Vector(-1, 0)
+        self.velocity = LEFT
 
     def right(self):
-        if self.velocity.x is -1:
+        if self.velocity.x == -1:
             return
-        self.velocity = Vector(1, 0)
+        self.velocity = RIGHT
 
     def calculate_fitness(self):
-        score = self.length - 1
-        # Fitness is primarily the score we achieved (how many apples) + how long we managed to stay alive
-        fitness = min(self.age, (2 ** score)) + (2 ** score)
-        # How many cells did we explore
-        fitness += len(self.visited) ** 2
-
-        if self.length == self.grid.dimensions.x * self.grid.dimensions.y:
-            # Big bonus for winning
-            fitness += score ** 2
-
-        return fitness
+        return calculate_fitness(self.length, self.age, len(self.visited),
+                                 self.grid.dimensions.x * self.grid.dimensions.y)
 
     def senses(self):
-        # Scan in 8 directions
-        directions = [
-            Vector(-1, 0),
-            Vector(-1, -1),
-            Vector(1, 0),
-            Vector(1, -1),
-            Vector(0, -1),
-            Vector(1, 1),
-            Vector(0, 1),
-            Vector(-1, 1)
-        ]
-        food_vision = [0 for x in range(0, len(directions))]
-        wall_vision = [0 for x in range(0, len(directions))]
-        self_vision = [0 for x in range(0, len(directions))]
-
-        for i, direction in enumerate(directions):
-            distance = 0
-            ray = self.position.copy()
-            for x in range(0, self.grid.dimensions.x):
-                ray = ray.add(direction)
-                distance += 1
-
-                # Wall!
-                if ray.x < 0 or ray.y < 0 or ray.x > self.grid.dimensions.x - 1 or ray.y > self.grid.dimensions.y - 1:
-                    wall_vision[i] = distance
-                    break
-                # Food!
-                if ray.equals(self.food.position):
-                    food_vision[i] = distance
-                    continue
-                # Self...
-                if self.is_collision(ray):
-                    self_vision[i] = distance
-                    break
-
-        senses = []
-        for direction in food_vision:
-            senses.append(1 / max(1, direction))
-
-        for vision in [wall_vision, self_vision]:
-            for direction in vision:
-                senses.append(int(direction is 1))
-
-        senses.append(int(-self.velocity.y > 0))
-        senses.append(int(self.velocity.y > 0))
-        senses.append(int(-self.velocity.x > 0))
-        senses.append(int(self.velocity.x > 0))
-
-        #senses.append(min(self.length, 100) / 100)
-        return senses
+        position = self.position
+        food = self.food.position
+        return sense(self.grid.dimensions.x, self.grid.dimensions.y, position.x, position.y, food.x, food.y,
+                     self.velocity.x, self.velocity.y, self.occupied, self.length, self.vision)
 
     def is_collision(self, position: Vector):
-        for i, segment in enumerate(self.tail):
-            if segment.equals(position) and i is not len(self.tail):
-                return True
         if position.x < 0 or position.y < 0:
             return True
         if position.x > self.grid.dimensions.x - 1 or position.y > self.grid.dimensions.y - 1:
             return True
-        return False
+        return position.y * self.grid.dimensions.x + position.x in self.occupied
 
 
 class Food(object):
@@ -199,7 +205,8 @@ class Food(object):
         self.grid = grid
         self.snake = snake
         self.move()
-        self.position = Vector(randint(0, self.grid.dimensions.x - 1), randint(0, self.grid.dimensions.y - 1))
+        self.position = Vector(snake.random.randint(0, self.grid.dimensions.x - 1),
+                               snake.random.randint(0, self.grid.dimensions.y - 1))
 
     def move(self):
         x = 0
@@ -207,6 +214,7 @@ class Food(object):
             x += 1
             if x > 100:
                 return
-            self.position = Vector(randint(0, self.grid.dimensions.x - 1), randint(0, self.grid.dimensions.y - 1))
+            self.position = Vector(self.snake.random.randint(0, self.grid.dimensions.x - 1),
+                                   self.snake.random.randint(0, self.grid.dimensions.y - 1))
             if not self.snake.is_collision(self.position):
                 return
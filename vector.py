@@ -1,15 +1,22 @@
 from math import sqrt
 
 
+# A value: vectors with the same x and y are equal and hash the same, so they work in sets and as dict keys
 class Vector(object):
+    __slots__ = ('x', 'y')
+
     def __init__(self, x: int, y: int):
         self.x = x
         self.y = y
 
+    def __eq__(self, other):
+        return isinstance(other, Vector) and self.x == other.x and self.y == other.y
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
     def equals(self, compare):
-        if compare.x is self.x and compare.y is self.y:
-            return True
-        return False
+        return self.x == compare.x and self.y == compare.y
 
     def sub(self, vector):
         return Vector(self.x - vector.x, self.y - vector.y)